@@ -0,0 +1,8 @@
+-- upgrade --
+ALTER TABLE `submission` ADD INDEX `idx_submission_task_id_3f8a61` (`task_id`, `verdict`, `id`);
+ALTER TABLE `submission` ADD INDEX `idx_submission_author__b72d04` (`author_id`, `verdict`, `id`);
+ALTER TABLE `submission` ADD INDEX `idx_submission_contest_e915c3` (`contest_id`, `verdict`, `id`);
+-- downgrade --
+ALTER TABLE `submission` DROP INDEX `idx_submission_task_id_3f8a61`;
+ALTER TABLE `submission` DROP INDEX `idx_submission_author__b72d04`;
+ALTER TABLE `submission` DROP INDEX `idx_submission_contest_e915c3`;
@@ -0,0 +1,15 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS `submissionsource` (
+    `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `source_code` LONGTEXT NOT NULL,
+    `submission_id` INT NOT NULL UNIQUE,
+    CONSTRAINT `fk_submissi_submissi_8e41a7c2` FOREIGN KEY (`submission_id`) REFERENCES `submission` (`id`) ON DELETE CASCADE
+) CHARACTER SET utf8mb4;
+INSERT INTO `submissionsource` (`submission_id`, `source_code`)
+    SELECT `id`, `source_code` FROM `submission`;
+ALTER TABLE `submission` DROP COLUMN `source_code`;
+-- downgrade --
+ALTER TABLE `submission` ADD `source_code` LONGTEXT NOT NULL;
+UPDATE `submission` JOIN `submissionsource` ON `submissionsource`.`submission_id` = `submission`.`id`
+    SET `submission`.`source_code` = `submissionsource`.`source_code`;
+DROP TABLE IF EXISTS `submissionsource`;
@@ -0,0 +1,10 @@
+-- upgrade --
+-- Existing text stays as plain UTF-8 until compressed from the admin home page
+ALTER TABLE `submissionsource` MODIFY COLUMN `source_code` LONGBLOB NOT NULL;
+ALTER TABLE `task` MODIFY COLUMN `content` LONGBLOB NOT NULL;
+ALTER TABLE `contest` MODIFY COLUMN `editorial_content` LONGBLOB NOT NULL;
+-- downgrade --
+-- Compressed rows must be decompressed before downgrading
+ALTER TABLE `submissionsource` MODIFY COLUMN `source_code` LONGTEXT NOT NULL;
+ALTER TABLE `task` MODIFY COLUMN `content` LONGTEXT NOT NULL;
+ALTER TABLE `contest` MODIFY COLUMN `editorial_content` LONGTEXT NOT NULL;
@@ -0,0 +1,11 @@
+-- upgrade --
+-- Existing test case results stay as rows until packed, see PackedTestCaseResults
+CREATE TABLE IF NOT EXISTS `packedtestcaseresults` (
+    `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `data` LONGBLOB NOT NULL,
+    `submission_id` INT NOT NULL UNIQUE,
+    CONSTRAINT `fk_packedte_submissi_2a9c4e71` FOREIGN KEY (`submission_id`) REFERENCES `submission` (`id`) ON DELETE CASCADE
+) CHARACTER SET utf8mb4;
+-- downgrade --
+-- Packed test case results must be unpacked to rows before downgrading
+DROP TABLE IF EXISTS `packedtestcaseresults`;
@@ -0,0 +1,22 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS `archivedsubmission` (
+    `id` INT NOT NULL PRIMARY KEY,
+    `time` DATETIME(6) NOT NULL,
+    `language` VARCHAR(30) NOT NULL,
+    `verdict` VARCHAR(5) NOT NULL,
+    `score` DECIMAL(6,3) NOT NULL,
+    `_subtask_scores` LONGTEXT,
+    `time_used` DECIMAL(5,3),
+    `memory_used` DECIMAL(7,3),
+    `first_solve` BOOL NOT NULL  DEFAULT 0,
+    `source_code` LONGBLOB NOT NULL,
+    `packed_test_case_results` LONGBLOB,
+    `author_id` INT NOT NULL,
+    `contest_id` INT,
+    `task_id` INT NOT NULL,
+    CONSTRAINT `fk_archived_user_3c8e5d02` FOREIGN KEY (`author_id`) REFERENCES `user` (`id`) ON DELETE CASCADE,
+    CONSTRAINT `fk_archived_contest_91f2ab47` FOREIGN KEY (`contest_id`) REFERENCES `contest` (`id`) ON DELETE SET NULL,
+    CONSTRAINT `fk_archived_task_5d7a6e13` FOREIGN KEY (`task_id`) REFERENCES `task` (`id`) ON DELETE CASCADE
+) CHARACTER SET utf8mb4;
+-- downgrade --
+DROP TABLE IF EXISTS `archivedsubmission`;
@@ -0,0 +1,4 @@
+-- upgrade --
+ALTER TABLE `submission` ADD `test_case_revision` VARCHAR(40);
+-- downgrade --
+ALTER TABLE `submission` DROP COLUMN `test_case_revision`;
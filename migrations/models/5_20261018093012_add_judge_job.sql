@@ -0,0 +1,15 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS `judgejob` (
+    `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `status` VARCHAR(10) NOT NULL  DEFAULT 'queued',
+    `attempts` INT NOT NULL  DEFAULT 0,
+    `available_time` DATETIME(6) NOT NULL,
+    `dispatch_time` DATETIME(6),
+    `submission_id` INT NOT NULL UNIQUE,
+    CONSTRAINT `fk_judgejob_submissi_5d0c7e1a` FOREIGN KEY (`submission_id`) REFERENCES `submission` (`id`) ON DELETE CASCADE,
+    KEY `idx_judgejob_status_3f5e2b` (`status`, `available_time`)
+) CHARACTER SET utf8mb4;
+INSERT INTO `judgejob` (`status`, `attempts`, `available_time`, `submission_id`)
+    SELECT 'queued', 0, UTC_TIMESTAMP(6), `id` FROM `submission` WHERE `verdict` = 'pe';
+-- downgrade --
+DROP TABLE IF EXISTS `judgejob`;
@@ -0,0 +1,4 @@
+-- upgrade --
+ALTER TABLE `judgejob` ADD `judge_host` VARCHAR(200);
+-- downgrade --
+ALTER TABLE `judgejob` DROP COLUMN `judge_host`;
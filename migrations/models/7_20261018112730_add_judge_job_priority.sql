@@ -0,0 +1,11 @@
+-- upgrade --
+ALTER TABLE `judgejob` ADD `priority` INT NOT NULL  DEFAULT 1;
+ALTER TABLE `judgejob` ADD `queue_time` DATETIME(6) NOT NULL;
+UPDATE `judgejob` SET `queue_time` = `available_time`;
+ALTER TABLE `judgejob` DROP INDEX `idx_judgejob_status_3f5e2b`;
+ALTER TABLE `judgejob` ADD INDEX `idx_judgejob_status_8a41d7` (`status`, `priority`, `available_time`);
+-- downgrade --
+ALTER TABLE `judgejob` DROP INDEX `idx_judgejob_status_8a41d7`;
+ALTER TABLE `judgejob` ADD INDEX `idx_judgejob_status_3f5e2b` (`status`, `available_time`);
+ALTER TABLE `judgejob` DROP COLUMN `priority`;
+ALTER TABLE `judgejob` DROP COLUMN `queue_time`;
@@ -0,0 +1,4 @@
+-- upgrade --
+ALTER TABLE `contest` ADD INDEX `idx_contest_start_t_5c9e0b` (`start_time`);
+-- downgrade --
+ALTER TABLE `contest` DROP INDEX `idx_contest_start_t_5c9e0b`;
@@ -0,0 +1,16 @@
+-- upgrade --
+CREATE TABLE IF NOT EXISTS `dailysolves` (
+    `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    `date` DATE NOT NULL,
+    `solves` INT NOT NULL  DEFAULT 0,
+    `user_id` INT NOT NULL,
+    UNIQUE KEY `uid_dailysolves_user_id_4b0e6f` (`user_id`, `date`),
+    CONSTRAINT `fk_dailysol_user_7a3c21d9` FOREIGN KEY (`user_id`) REFERENCES `user` (`id`) ON DELETE CASCADE,
+    KEY `idx_dailysolves_date_9c2f15` (`date`, `user_id`)
+) CHARACTER SET utf8mb4;
+-- Days are in Hong Kong time (UTC+8, no daylight saving)
+INSERT INTO `dailysolves` (`user_id`, `date`, `solves`)
+    SELECT `author_id`, DATE(DATE_ADD(`time`, INTERVAL 8 HOUR)), COUNT(*) FROM `submission`
+    WHERE `first_solve` = 1 GROUP BY `author_id`, DATE(DATE_ADD(`time`, INTERVAL 8 HOUR));
+-- downgrade --
+DROP TABLE IF EXISTS `dailysolves`;
@@ -0,0 +1,118 @@
+"""
+Stand-in for the judging backend, for trying out the judge pool locally.
+
+Accepts every submission and reports it Accepted after a delay, with one test case per
+subtask reported incrementally. Run one per port and list them in JUDGE_HOSTS:
+
+    python scripts/fake_judge.py --port 3101 --site http://localhost:3000
+    python scripts/fake_judge.py --port 3102 --site http://localhost:3000 --delay 5
+
+Stop one to see its submissions drained to the others.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+from typing import Optional
+
+import aiohttp
+import ujson as json
+from quart import Quart, abort, jsonify, request
+
+logging.basicConfig(level="INFO", format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("fake_judge")
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+parser.add_argument("--port", type=int, default=3101)
+parser.add_argument("--site", default="http://localhost:3000", help="URL of the online judge")
+parser.add_argument("--delay", type=float, default=2, help="Mean seconds taken to judge")
+parser.add_argument("--config", default="config.json", help="config.json holding SECRET_KEY")
+args = parser.parse_args()
+
+with open(args.config) as f:
+    secret_key = json.load(f)["SECRET_KEY"]
+
+app = Quart(__name__)
+
+
+def check_token() -> None:
+    if request.headers.get("X-Auth-Token") != secret_key:
+        abort(403)
+
+
+def get_subtask_count(task_id: str) -> int:
+    try:
+        with open(os.path.join("test_cases", task_id, "config.json")) as f:
+            return len(json.load(f).get("points", [100]))
+    except (FileNotFoundError, ValueError):
+        return 1
+
+
+async def judge(submission_id: int, task_id: str, judge_host: Optional[str]) -> None:
+    subtask_count = get_subtask_count(task_id)
+    headers = {"X-Auth-Token": secret_key}
+    if judge_host:
+        headers["X-Judge-Host"] = judge_host  # Identifies this host as the one judging it
+    async with aiohttp.ClientSession() as session:
+        # Report each subtask as it finishes, then finalise with nothing left to report
+        for subtask in range(1, subtask_count + 1):
+            await asyncio.sleep(random.uniform(0.5, 1.5) * args.delay / subtask_count)
+            body = {
+                "test_case_results": [
+                    {
+                        "subtask": subtask,
+                        "test_case": 1,
+                        "verdict": "ac",
+                        "score": 100,
+                        "time_used": 0.01,
+                        "memory_used": 1
+                    }
+                ]
+            }
+            async with session.post(
+                f"{args.site}/submission/{submission_id}/report/partial",
+                json=body,
+                headers=headers
+            ):
+                pass
+        async with session.post(
+            f"{args.site}/submission/{submission_id}/report",
+            json={"test_case_results": []},
+            headers=headers
+        ) as resp:
+            logger.info(f"Reported submission {submission_id}: {resp.status}")
+
+
+@app.route("/ping")
+async def ping() -> str:
+    # Task info is not used here, so payloads sent by hash need not be fetched
+    return jsonify(success=True, features=["task_payload_hash"])
+
+
+@app.route("/pull_test_cases", methods=["POST"])
+async def pull_test_cases() -> str:
+    check_token()
+    data = await request.get_json(silent=True)
+    task_ids = data and data.get("task_ids")
+    if task_ids:
+        logger.info(f"Pulling test cases of tasks {', '.join(task_ids)}")
+    else:
+        logger.info("Pulling test cases of all tasks")
+    return jsonify(success=True)
+
+
+@app.route("/judge", methods=["POST"])
+async def judge_submission() -> str:
+    check_token()
+    data = await request.json
+    logger.info(f"Judging submission {data['submission']['id']}")
+    app.add_background_task(
+        judge, data["submission"]["id"], data["task_info"]["task_id"], data.get("judge_host")
+    )
+    return jsonify(success=True)
+
+
+if __name__ == "__main__":
+    app.run(port=args.port)
@@ -31,7 +31,9 @@ rate_limiter = RateLimiter(default_limits=[RateLimit(150, timedelta(seconds=60))
 def create_app() -> Quart:
     app = Quart(__name__, static_url_path="/static")
     app.config.from_file("../config.json", json.load)  # ujson
-    app.config["JUDGE_HOST"] = app.config["JUDGE_HOST"].rstrip("/")
+    # A single JUDGE_HOST is shorthand for a pool of one
+    if "JUDGE_HOSTS" not in app.config:
+        app.config["JUDGE_HOSTS"] = [app.config["JUDGE_HOST"]]
 
     app.config["TRAP_HTTP_EXCEPTIONS"] = True  # To set custom page for all HTTP exceptions
     app.config["JSON_SORT_KEYS"] = False
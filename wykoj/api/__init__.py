@@ -1,6 +1,10 @@
 from .chesscom import ChessComAPI
 from .judge import JudgeAPI
+from .judge_queue import JudgeQueue
 from .nekos_best import NekosBestAPI
+from .submission_events import SubmissionEvents
 from .test_cases import TestCaseAPI
 
-__all__ = ("ChessComAPI", "JudgeAPI", "NekosBestAPI", "TestCaseAPI")
+__all__ = (
+    "ChessComAPI", "JudgeAPI", "JudgeQueue", "NekosBestAPI", "SubmissionEvents", "TestCaseAPI"
+)
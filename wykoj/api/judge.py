@@ -1,56 +1,167 @@
+import asyncio
+import hashlib
 import logging
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+import ujson as json
 from aiohttp import ClientTimeout
 from quart import current_app
 
-import wykoj
 from wykoj.api.test_cases import TestCaseAPI
-from wykoj.constants import ALLOWED_LANGUAGES, Verdict
-from wykoj.models import Submission
+from wykoj.constants import ALLOWED_LANGUAGES
+from wykoj.models import Submission, SubmissionSource, Task
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class JudgeHost:
+    """A judging backend in the pool, with its health and load as last seen by the dispatcher."""
+    url: str
+    concurrency: int  # Maximum number of submissions judged at once
+    is_online: bool = False
+    failed_pings: int = 0  # Consecutive pings failed, see JudgeQueue.DRAIN_AFTER_FAILED_PINGS
+    in_flight: int = 0
+    # Whether the host advertised in /ping that it fetches task payloads by hash, otherwise
+    # task payloads are always sent to it in full
+    accepts_payload_hash: bool = False
+    # Hashes of task payloads this host has been sent in full, see JudgeAPI.judge_submission
+    known_payloads: Set[str] = field(default_factory=set)
+    # Test case revision the host last acknowledged pulling, None if unknown. Stamped on
+    # submissions sent to it, see StaleRejudge
+    revision: Optional[str] = None
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.concurrency
+
+
 class JudgeAPI:
-    """Wrapper for WYKOJ Judge Server API."""
-    _is_online = False
+    """Wrapper for WYKOJ Judge Server API, spread over a pool of judge hosts."""
+    _hosts: Optional[List[JudgeHost]] = None
+    # Task payloads by content hash, for judge hosts to fetch ones they are missing
+    _task_payloads: Dict[str, Dict[str, Any]] = {}
+    _task_payload_hashes: Dict[str, str] = {}  # Task ID -> hash of its current payload
+    # Task ID -> (test case revision, time limit, memory limit) its current payload was built
+    # from, so that it is only rebuilt and hashed again once one of these changes
+    _task_payload_keys: Dict[str, Tuple[str, Decimal, int]] = {}
+
+    @staticmethod
+    def get_hosts() -> List[JudgeHost]:
+        if JudgeAPI._hosts is None:
+            default_concurrency = current_app.config.get("JUDGE_CONCURRENCY", 8)
+            JudgeAPI._hosts = []
+            for host in current_app.config["JUDGE_HOSTS"]:
+                if isinstance(host, str):
+                    host = {"host": host}
+                JudgeAPI._hosts.append(
+                    JudgeHost(
+                        url=host["host"].rstrip("/"),
+                        concurrency=host.get("concurrency", default_concurrency)
+                    )
+                )
+        return JudgeAPI._hosts
+
+    @staticmethod
+    def get_host(url: str) -> Optional[JudgeHost]:
+        return next((host for host in JudgeAPI.get_hosts() if host.url == url), None)
 
     @staticmethod
     def is_online() -> bool:
-        return JudgeAPI._is_online
+        """The judge is online as long as any host in the pool is."""
+        return any(host.is_online for host in JudgeAPI.get_hosts())
+
+    @staticmethod
+    def choose_host() -> Optional[JudgeHost]:
+        """Least loaded online host with a free slot, relative to its concurrency."""
+        hosts = [
+            host for host in JudgeAPI.get_hosts()
+            if host.is_online and host.in_flight < host.concurrency
+        ]
+        return min(hosts, key=lambda host: host.load, default=None)
 
     @staticmethod
     async def update_status() -> None:
+        await asyncio.gather(*[JudgeAPI._update_host_status(host) for host in JudgeAPI.get_hosts()])
+
+    @staticmethod
+    async def _update_host_status(host: JudgeHost) -> None:
         try:
-            resp = await current_app.session.get(
-                current_app.config["JUDGE_HOST"] + "/ping", timeout=ClientTimeout(total=5)
-            )
+            resp = await current_app.session.get(host.url + "/ping", timeout=ClientTimeout(total=5))
             data = await resp.json()
-            assert data["success"] is True, "SECRET_KEY does not match backend"
+            assert data["success"] is True, "SECRET_KEY does not match backend"
         except Exception as e:
-            logger.error(f"Error in checking Judge API status:\n{e.__class__.__name__}: {str(e)}")
-            JudgeAPI._is_online = False
+            logger.error(
+                f"Error in checking Judge API status of {host.url}:\n"
+                f"{e.__class__.__name__}: {str(e)}"
+            )
+            host.is_online = False
+            host.failed_pings += 1
         else:
-            JudgeAPI._is_online = True
+            host.failed_pings = 0
+            host.accepts_payload_hash = "task_payload_hash" in data.get("features", [])
+            if not host.is_online:
+                logger.info(f"Judge host {host.url} is online")
+                # It may have restarted and lost the payloads it was sent
+                host.known_payloads.clear()
+                # Nor is it known which test cases it has until it pulls them
+                host.revision = None
+                asyncio.create_task(
+                    JudgeAPI._pull_test_cases(host, None, TestCaseAPI.get_revision())
+                )
+            host.is_online = True
+
+    @staticmethod
+    async def pull_test_cases(task_ids: Optional[List[str]] = None) -> None:
+        """
+        Ask judge hosts to pull test cases, only of tasks in `task_ids` if given. Call after
+        the test case revision changes.
+        """
+        revision = TestCaseAPI.get_revision()
+        await asyncio.gather(
+            *[
+                JudgeAPI._pull_test_cases(host, task_ids, revision)
+                for host in JudgeAPI.get_hosts()
+            ]
+        )
 
     @staticmethod
-    async def pull_test_cases() -> None:
+    async def _pull_test_cases(host: JudgeHost, task_ids: Optional[List[str]],
+                               revision: Optional[str]) -> None:
         try:
             resp = await current_app.session.post(
-                current_app.config["JUDGE_HOST"] + "/pull_test_cases",
+                host.url + "/pull_test_cases",
+                json={"task_ids": task_ids} if task_ids is not None else None,
                 headers={"X-Auth-Token": current_app.secret_key}
             )
             data = await resp.json()
             assert data["success"] is True, "SECRET_KEY does not match backend"
         except Exception as e:
             logger.error(
-                f"Error in sending pull test cases request:\n{e.__class__.__name__}: {str(e)}"
+                f"Error in sending pull test cases request to {host.url}:\n"
+                f"{e.__class__.__name__}: {str(e)}"
             )
+        else:
+            host.revision = revision
 
     @staticmethod
-    async def judge_submission(submission: Submission) -> None:
-        await submission.fetch_related("task")
-        task = submission.task
+    def get_task_payload(payload_hash: str) -> Optional[Dict[str, Any]]:
+        return JudgeAPI._task_payloads.get(payload_hash)
+
+    @staticmethod
+    async def _build_task_payload(task: Task) -> Tuple[str, Dict[str, Any]]:
+        """Task info sent to the judge, and its content hash. Stored for get_task_payload."""
+        revision = TestCaseAPI.get_revision()
+        key = (revision, task.time_limit, task.memory_limit)
+        payload_hash = JudgeAPI._task_payload_hashes.get(task.task_id)
+        if (
+            revision is not None and payload_hash
+            and JudgeAPI._task_payload_keys.get(task.task_id) == key
+        ):
+            return payload_hash, JudgeAPI._task_payloads[payload_hash]
+
         config = await TestCaseAPI.get_config(task.task_id)
 
         task_info = {
@@ -62,30 +173,54 @@ class JudgeAPI:
         if config["grader"]:
             task_info["grader_source_code"] = config["grader_source_code"]
             task_info["grader_language"] = ALLOWED_LANGUAGES[config["grader_language"]]
-        if "dependencies" in config:        
+        if "dependencies" in config:
             task_info["dependencies"] = config["dependencies"]
 
+        payload_hash = hashlib.sha256(json.dumps(task_info, sort_keys=True).encode()).hexdigest()
+        old_hash = JudgeAPI._task_payload_hashes.get(task.task_id)
+        if old_hash != payload_hash:
+            JudgeAPI._task_payloads.pop(old_hash, None)
+            JudgeAPI._task_payloads[payload_hash] = task_info
+            JudgeAPI._task_payload_hashes[task.task_id] = payload_hash
+        JudgeAPI._task_payload_keys[task.task_id] = key
+        return payload_hash, task_info
+
+    @staticmethod
+    async def judge_submission(submission: Submission, host: JudgeHost) -> None:
+        await submission.fetch_related("task")
+        task = submission.task
+        payload_hash, task_info = await JudgeAPI._build_task_payload(task)
+
+        # The task payload, including grader source code, is sent in full once per host.
+        # Afterwards only its hash is, and the judge fetches the payload from
+        # /task_info/<hash> if it is not cached there. Hosts that do not support this are
+        # always sent it in full.
+        if host.accepts_payload_hash:
+            if payload_hash in host.known_payloads:
+                task_info = {"task_id": task.task_id, "hash": payload_hash}
+            else:
+                task_info = {**task_info, "hash": payload_hash}
+
         body = {
+            # Echoed back by the judge in the X-Judge-Host header of its reports, see
+            # JudgeQueue.owns_job
+            "judge_host": host.url,
             "task_info": task_info,
             "task_type": "INTERACTIVE" if task.is_interactive else "BATCH",
             "submission": {
                 "id": submission.id,
                 "language": ALLOWED_LANGUAGES[submission.language],
-                "source_code": submission.source_code
+                "source_code": await SubmissionSource.get_source_code(submission.id)
             }
         }
 
-        try:
-            await current_app.session.post(
-                current_app.config["JUDGE_HOST"] + "/judge",
-                json=body,
-                headers={"X-Auth-Token": current_app.secret_key}
-            )
-        except Exception as e:
-            logger.error(
-                f"Error in sending judge submission request:\n{e.__class__.__name__}: {str(e)}"
-            )
-            logger.error(f"Marked SE for submission {submission.id}")
-            submission.verdict = Verdict.SYSTEM_ERROR
-            await submission.save()
-            raise e from None
+        # Failures are retried by JudgeQueue, which marks SE once it gives up
+        # The revision of the test cases the host has, which lags behind TestCaseAPI's until
+        # the host acknowledges pulling them
+        await Submission.filter(id=submission.id).update(test_case_revision=host.revision)
+        await current_app.session.post(
+            host.url + "/judge",
+            json=body,
+            headers={"X-Auth-Token": current_app.secret_key}
+        )
+        host.known_payloads.add(payload_hash)
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+from heapq import heapify, heappop, heappush
+from statistics import mean
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from aiohttp import ClientResponseError
+from pytz import utc
+from quart import current_app
+from tortoise.expressions import F
+from tortoise.functions import Count
+
+from wykoj.api.judge import JudgeAPI, JudgeHost
+from wykoj.api.submission_events import SubmissionEvents
+from wykoj.constants import ContestStatus, JudgeJobStatus, JudgePriority, Verdict
+from wykoj.models import Contest, JudgeJob, Submission
+
+logger = logging.getLogger(__name__)
+
+
+def order_for_dispatch(jobs: List[Dict[str, Any]],
+                       author_load: Counter) -> Iterator[Dict[str, Any]]:
+    """
+    Order queued jobs (values() dicts sorted by id in each class) for dispatch. Priority classes
+    go in order. Within a class, the next job is the oldest of the author with the fewest jobs
+    in flight or ordered before it, so one author submitting repeatedly cannot hold up everyone
+    else.
+    """
+    author_load = Counter(author_load)
+    for priority in sorted({job["priority"] for job in jobs}):
+        jobs_by_author: Dict[int, Deque[Dict[str, Any]]] = defaultdict(deque)
+        for job in jobs:
+            if job["priority"] == priority:
+                jobs_by_author[job["author_id"]].append(job)
+
+        heap = [(author_load[author], q[0]["id"], author) for author, q in jobs_by_author.items()]
+        heapify(heap)
+        while heap:
+            _, _, author = heappop(heap)
+            yield jobs_by_author[author].popleft()
+            author_load[author] += 1
+            if jobs_by_author[author]:
+                heappush(heap, (author_load[author], jobs_by_author[author][0]["id"], author))
+
+
+class JudgeQueue:
+    """
+    Database-backed queue of submissions to be sent to the judging backend.
+
+    Submissions are queued as JudgeJob rows, so they survive restarts and failed requests.
+    A single dispatcher loop sends them to the least loaded online judge host, never more than
+    the concurrency of each host at a time, and retries failed requests with exponential backoff.
+    """
+    POLL_INTERVAL = 1  # s, how often the queue is checked without being woken up
+    RETRY_BASE_DELAY = 5  # s, doubled for every failed attempt
+    DISPATCH_WINDOW = 500  # Queued jobs considered at once for priority and fair share
+    # A host busy judging may miss a ping, so its jobs are only given to the rest of the pool
+    # once it has missed this many in a row
+    DRAIN_AFTER_FAILED_PINGS = 3
+
+    _wakeup: Optional[asyncio.Event] = None
+    # Seconds recent jobs of each priority class waited in the queue before being dispatched
+    wait_times: Dict[int, Deque[float]] = {
+        priority: deque(maxlen=100)
+        for priority in (JudgePriority.CONTEST, JudgePriority.PRACTICE, JudgePriority.REJUDGE)
+    }
+
+    @staticmethod
+    def _notify() -> None:
+        if JudgeQueue._wakeup:
+            JudgeQueue._wakeup.set()
+
+    @staticmethod
+    async def enqueue(*submissions: Submission, priority: Optional[int] = None) -> None:
+        """
+        Queue submissions for judging, replacing any job they already have.
+        Without a priority given, submissions to ongoing contests go before practice.
+        """
+        if not submissions:
+            return
+
+        if priority is None:
+            contest_ids = {s.contest_id for s in submissions if s.contest_id}
+            ongoing_contest_ids = {
+                contest.id
+                for contest in await Contest.filter(id__in=contest_ids)
+                if contest.status == ContestStatus.ONGOING
+            } if contest_ids else set()
+
+        now = datetime.now(utc)
+        await JudgeJob.filter(submission_id__in=[s.id for s in submissions]).delete()
+        await JudgeJob.bulk_create(
+            [
+                JudgeJob(
+                    submission_id=s.id,
+                    priority=(
+                        priority if priority is not None else JudgePriority.CONTEST
+                        if s.contest_id in ongoing_contest_ids else JudgePriority.PRACTICE
+                    ),
+                    queue_time=now,
+                    available_time=now
+                ) for s in submissions
+            ]
+        )
+        JudgeQueue._notify()
+
+    @staticmethod
+    async def owns_job(submission_id: int, judge_host: Optional[str]) -> bool:
+        """
+        Whether a report from `judge_host` on a submission should be accepted, i.e. its job is
+        dispatched to that host. Reports from a host whose job was since requeued, given to
+        another host or replaced by a rejudge, or already reported on, are not.
+        Reports without a host, from judges that do not send one, are always accepted.
+        """
+        if judge_host is None:
+            return True
+        return await JudgeJob.exists(
+            submission_id=submission_id, status=JudgeJobStatus.DISPATCHED, judge_host=judge_host
+        )
+
+    @staticmethod
+    async def complete(submission_id: int, judge_host: Optional[str] = None) -> bool:
+        """
+        Remove the job of a submission whose result was reported, freeing a dispatch slot.
+        Reports from a host that no longer owns the job are ignored.
+        Returns whether it was the last rejudge job queued.
+        """
+        if not await JudgeQueue.owns_job(submission_id, judge_host):
+            return False
+        priority = await JudgeJob.filter(submission_id=submission_id).first().values_list(
+            "priority", flat=True
+        )
+        await JudgeJob.filter(submission_id=submission_id).delete()
+        JudgeQueue._notify()
+        return (
+            priority == JudgePriority.REJUDGE
+            and not await JudgeJob.exists(priority=JudgePriority.REJUDGE)
+        )
+
+    @staticmethod
+    async def run_forever() -> None:
+        JudgeQueue._wakeup = asyncio.Event()
+        while True:
+            JudgeQueue._wakeup.clear()
+            try:
+                await JudgeQueue._dispatch_ready()
+            except Exception as e:
+                logger.error(f"Error in dispatching judge queue:\n{e.__class__.__name__}: {str(e)}")
+            try:
+                await asyncio.wait_for(JudgeQueue._wakeup.wait(), timeout=JudgeQueue.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _dispatch_ready() -> None:
+        now = datetime.now(utc)
+        # Dispatched jobs never reported on were lost by the judge, e.g. it restarted
+        report_timeout = timedelta(seconds=current_app.config.get("JUDGE_REPORT_TIMEOUT_S", 600))
+        lost = await JudgeJob.filter(
+            status=JudgeJobStatus.DISPATCHED, dispatch_time__lt=now - report_timeout
+        ).update(status=JudgeJobStatus.QUEUED, available_time=now, judge_host=None)
+        if lost:
+            logger.warning(f"[Judge Queue] Requeued {lost} submission(s) not reported on in time")
+
+        # Drain hosts that went down, so their submissions are judged by the rest of the pool
+        hosts = JudgeAPI.get_hosts()
+        offline_urls = [
+            host.url for host in hosts
+            if host.failed_pings >= JudgeQueue.DRAIN_AFTER_FAILED_PINGS
+        ]
+        if offline_urls:
+            drained = await JudgeJob.filter(
+                status=JudgeJobStatus.DISPATCHED, judge_host__in=offline_urls
+            ).update(status=JudgeJobStatus.QUEUED, available_time=now, judge_host=None)
+            if drained:
+                logger.warning(f"[Judge Queue] Requeued {drained} submission(s) from offline hosts")
+
+        in_flight = await JudgeJob.filter(status=JudgeJobStatus.DISPATCHED).annotate(
+            count=Count("id")
+        ).group_by("judge_host").values("judge_host", "count")
+        in_flight = {row["judge_host"]: row["count"] for row in in_flight}
+        for host in hosts:
+            host.in_flight = in_flight.get(host.url, 0)
+
+        slots = sum(
+            max(host.concurrency - host.in_flight, 0) for host in hosts if host.is_online
+        )
+        if slots <= 0:
+            return  # Also the case while every host is down, so no attempts are used up
+
+        for job in await JudgeQueue.get_dispatch_order(now):
+            host = JudgeAPI.choose_host()
+            if not host:
+                break
+            # Claim the job with a conditional update so it is never dispatched twice
+            claimed = await JudgeJob.filter(id=job["id"], status=JudgeJobStatus.QUEUED).update(
+                status=JudgeJobStatus.DISPATCHED,
+                dispatch_time=now,
+                judge_host=host.url,
+                attempts=F("attempts") + 1
+            )
+            if claimed:
+                host.in_flight += 1
+                JudgeQueue.wait_times[job["priority"]].append(
+                    (now - job["queue_time"]).total_seconds()
+                )
+                asyncio.create_task(JudgeQueue._dispatch(job["id"], job["submission_id"], host))
+
+    @staticmethod
+    async def get_dispatch_order(now: datetime) -> List[Dict[str, Any]]:
+        """Queued jobs ready at `now`, in the order they will be dispatched."""
+        jobs = await JudgeJob.filter(
+            status=JudgeJobStatus.QUEUED, available_time__lte=now
+        ).order_by("priority", "id").limit(JudgeQueue.DISPATCH_WINDOW).values(
+            "id", "submission_id", "priority", "queue_time", author_id="submission__author_id"
+        )
+        author_load = Counter(
+            job["author_id"] for job in await JudgeJob.filter(
+                status=JudgeJobStatus.DISPATCHED
+            ).values(author_id="submission__author_id")
+        )
+        return list(order_for_dispatch(jobs, author_load))
+
+    @staticmethod
+    async def get_stats() -> Dict[int, Dict[str, Any]]:
+        """Queue length, longest current wait and recent waits of each priority class, in s."""
+        now = datetime.now(utc)
+        queued = await JudgeJob.filter(status=JudgeJobStatus.QUEUED).values(
+            "priority", "queue_time"
+        )
+        stats = {}
+        for priority, wait_times in JudgeQueue.wait_times.items():
+            queue_times = [job["queue_time"] for job in queued if job["priority"] == priority]
+            stats[priority] = {
+                "queued": len(queue_times),
+                "longest_wait": (now - min(queue_times)).total_seconds() if queue_times else None,
+                "mean_recent_wait": mean(wait_times) if wait_times else None,
+                "max_recent_wait": max(wait_times, default=None)
+            }
+        return stats
+
+    @staticmethod
+    async def _dispatch(job_id: int, submission_id: int, host: JudgeHost) -> None:
+        job = await JudgeJob.filter(id=job_id).first()
+        submission = await Submission.filter(id=submission_id).first()
+        if not job or not submission:
+            return  # Reported on or deleted in the meantime
+
+        max_attempts = current_app.config.get("JUDGE_MAX_ATTEMPTS", 5)
+        if job.attempts > max_attempts:  # Sent every time, but never reported on
+            await JudgeQueue._give_up(job, submission)
+            return
+
+        try:
+            await JudgeAPI.judge_submission(submission, host)
+        except Exception as e:
+            logger.error(
+                f"Error in sending judge submission request to {host.url} "
+                f"(attempt {job.attempts}):\n{e.__class__.__name__}: {str(e)}"
+            )
+            if not isinstance(e, ClientResponseError):
+                # Unreachable rather than rejecting this submission, take it out of the pool
+                # until the next status check
+                host.is_online = False
+            if job.attempts >= max_attempts:
+                await JudgeQueue._give_up(job, submission)
+            else:
+                delay = JudgeQueue.RETRY_BASE_DELAY * 2**(job.attempts - 1)
+                await JudgeJob.filter(id=job.id).update(
+                    status=JudgeJobStatus.QUEUED,
+                    available_time=datetime.now(utc) + timedelta(seconds=delay),
+                    judge_host=None
+                )
+            JudgeQueue._notify()
+
+    @staticmethod
+    async def _give_up(job: JudgeJob, submission: Submission) -> None:
+        logger.error(f"Marked SE for submission {submission.id}")
+        submission.verdict = Verdict.SYSTEM_ERROR
+        await submission.save()
+        await job.delete()
+        SubmissionEvents.publish(submission.id, verdict=submission.verdict)
+        JudgeQueue._notify()
@@ -0,0 +1,29 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Set
+
+
+class SubmissionEvents:
+    """
+    In-process publish/subscribe of submission updates, e.g. verdicts reported by the judge,
+    pushed to every page open on the submission.
+    """
+    _subscribers: Dict[int, Set["asyncio.Queue[Dict[str, Any]]"]] = defaultdict(set)
+
+    @staticmethod
+    def publish(submission_id: int, **data: Any) -> None:
+        for queue in SubmissionEvents._subscribers.get(submission_id, ()):
+            queue.put_nowait(data)
+
+    @staticmethod
+    @asynccontextmanager
+    async def subscribe(submission_id: int) -> AsyncIterator["asyncio.Queue[Dict[str, Any]]"]:
+        queue = asyncio.Queue()
+        SubmissionEvents._subscribers[submission_id].add(queue)
+        try:
+            yield queue
+        finally:
+            SubmissionEvents._subscribers[submission_id].discard(queue)
+            if not SubmissionEvents._subscribers[submission_id]:
+                del SubmissionEvents._subscribers[submission_id]
@@ -1,14 +1,18 @@
+import hashlib
+import logging
 import os
+import re
 from dataclasses import dataclass
-from itertools import count
-from typing import Any, Dict, List, Optional
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
 
 import aiofiles
 import ujson as json
-from aiocache import cached
 
 from wykoj.constants import ALLOWED_LANGUAGES
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass(frozen=True)
 class SampleTestCase:
@@ -22,28 +26,191 @@ async def read_file(path: str) -> str:
         return await f.read()
 
 
-def get_files(task_id: str) -> List[str]:
-    dir_path = os.path.join("test_cases", task_id)
-    if not os.path.isdir(dir_path):
-        return []
-    return [f for f in os.listdir(dir_path) if os.path.isfile(os.path.join(dir_path, f))]
-
-
-def get_package_path(task_id: str) -> str:
-    zip_path = os.path.join("test_cases", task_id, "package.zip")
-    if os.path.isfile(zip_path):
-        return zip_path
-    # Fallback to `task_id`/package/
-    folder_path = os.path.join("test_cases", task_id, "package")
-    if os.path.isdir(folder_path):
-        return folder_path
+@dataclass(frozen=True)
+class TestCaseFile:
+    size: int
+    mtime_ns: int
+
+
+@dataclass(frozen=True)
+class TaskManifest:
+    files: Dict[str, TestCaseFile]
+    sample_test_case_count: int
+    package_path: Optional[str]
+    # Hash of the paths and contents of files in package/, None for package.zip, which is
+    # served as is, or before the manifest is built
+    package_hash: Optional[str]
+
+
+def _hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def hash_folder(folder_path: str) -> str:
+    """Hash of the paths and contents of files in a folder. Blocking."""
+    sha256 = hashlib.sha256()
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            sha256.update(os.path.relpath(file_path, folder_path).encode() + b"\0")
+            sha256.update(_hash_file(file_path).encode())
+    return sha256.hexdigest()
+
+
+def _build_task_manifest(dir_path: str, hash_package: bool = True) -> TaskManifest:
+    files = {}
+    for entry in os.scandir(dir_path):
+        if not entry.is_file():
+            continue
+        stat = entry.stat()
+        files[entry.name] = TestCaseFile(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    sample_test_case_count = 0
+    while (
+        f"0.{sample_test_case_count + 1}.in" in files
+        and f"0.{sample_test_case_count + 1}.out" in files
+    ):
+        sample_test_case_count += 1
+
+    if "package.zip" in files:
+        package_path = os.path.join(dir_path, "package.zip")
+        package_hash = None
+    elif os.path.isdir(os.path.join(dir_path, "package")):
+        # Fallback to `task_id`/package/
+        package_path = os.path.join(dir_path, "package")
+        package_hash = hash_folder(package_path) if hash_package else None
     else:
-        return None
+        package_path = package_hash = None
+    return TaskManifest(
+        files=files,
+        sample_test_case_count=sample_test_case_count,
+        package_path=package_path,
+        package_hash=package_hash
+    )
+
+
+def build_manifest(old: Optional[Dict[str, TaskManifest]],
+                   task_ids: Optional[Set[str]] = None) -> Dict[str, TaskManifest]:
+    """
+    Scan test_cases/ for the files of every task, or only rescan tasks in `task_ids`.
+    Blocking.
+    """
+    old = old or {}
+    if task_ids is None:
+        if not os.path.isdir("test_cases"):
+            return {}
+        return {
+            entry.name: _build_task_manifest(entry.path)
+            for entry in os.scandir("test_cases")
+            if entry.is_dir() and not entry.name.startswith(".")
+        }
+
+    manifest = dict(old)
+    for task_id in task_ids:
+        dir_path = os.path.join("test_cases", task_id)
+        if os.path.isdir(dir_path):
+            manifest[task_id] = _build_task_manifest(dir_path)
+        else:
+            manifest.pop(task_id, None)
+    return manifest
+
+
+def _get_task_manifest(task_id: str) -> Optional[TaskManifest]:
+    if _manifest is None:
+        # Not built yet at startup, when the judge queue may already be running. Read from
+        # disk meanwhile, without hashing package/ on the event loop
+        dir_path = os.path.join("test_cases", task_id)
+        if not os.path.isdir(dir_path):
+            return None
+        return _build_task_manifest(dir_path, hash_package=False)
+    return _manifest.get(task_id)
+
+
+def get_files(task_id: str) -> List[str]:
+    manifest = _get_task_manifest(task_id)
+    return list(manifest.files) if manifest else []
+
+
+def get_package_path(task_id: str) -> Optional[str]:
+    manifest = _get_task_manifest(task_id)
+    return manifest.package_path if manifest else None
+
+
+T = TypeVar("T")
+
+# Task ID -> files of the task, built in a worker thread after each test case update,
+# so that no directory is listed on the request path, see TestCaseAPI.refresh
+_manifest: Optional[Dict[str, TaskManifest]] = None
+# Revision of the test case repository, None if unknown
+_revision: Optional[str] = None
+# (Function name, task ID) -> result of a read of test case files
+_cache: Dict[Tuple[str, str], Any] = {}
+# Bumped on invalidation of a task, so that results read meanwhile are not cached stale
+_versions: Dict[str, int] = {}
+
+
+def cached_per_task(func: Callable[[str], Awaitable[T]]) -> Callable[[str], Awaitable[T]]:
+    """
+    Cache results by task ID until the test cases of the task change.
+    Nothing is cached while the revision is unknown, so that edits are seen right away.
+    """
+    @wraps(func)
+    async def wrapper(task_id: str) -> T:
+        if _revision is None:
+            return await func(task_id)
+        key = (func.__name__, task_id)
+        if key in _cache:
+            return _cache[key]
+        version = _versions.get(task_id, 0)
+        result = await func(task_id)
+        if _versions.get(task_id, 0) == version:
+            _cache[key] = result
+        return result
+
+    return wrapper
+
 
 class TestCaseAPI:
     @staticmethod
-    @cached(ttl=5)
+    def refresh(revision: Optional[str], task_ids: Optional[Set[str]] = None) -> None:
+        """
+        Rebuild the manifest of test case files after the test case repository is updated
+        to `revision`, and invalidate cached reads. Only tasks in `task_ids` are rescanned
+        and invalidated if given. Blocking, call from a worker thread.
+        """
+        global _manifest, _revision
+        _manifest = build_manifest(_manifest, task_ids)
+        _revision = revision
+        for task_id in task_ids if task_ids is not None else set(_versions) | set(_manifest):
+            _versions[task_id] = _versions.get(task_id, 0) + 1
+        for key in list(_cache):
+            if task_ids is None or key[1] in task_ids:
+                _cache.pop(key, None)
+        total_files = sum(len(manifest.files) for manifest in _manifest.values())
+        logger.info(
+            f"Built test case manifest of {len(_manifest)} tasks, {total_files} files, "
+            f"{'all' if task_ids is None else len(task_ids)} task(s) rescanned"
+        )
+
+    @staticmethod
+    def get_revision() -> Optional[str]:
+        """Revision of the test case repository the manifest was built from, None if unknown."""
+        return _revision
+
+    @staticmethod
+    def get_manifest(task_id: str) -> Optional[TaskManifest]:
+        return _get_task_manifest(task_id)
+
+    @staticmethod
+    @cached_per_task
     async def get_config(task_id: str) -> Optional[Dict[str, Any]]:
+        if "config.json" not in get_files(task_id):
+            return None
         dir_path = os.path.join("test_cases", task_id)
         try:
             config = json.loads(await read_file(os.path.join(dir_path, "config.json")))
@@ -73,7 +240,7 @@ class TestCaseAPI:
             return None
 
     @staticmethod
-    @cached(ttl=5)
+    @cached_per_task
     async def check_test_cases_ready(task_id: str) -> bool:
         config = await TestCaseAPI.get_config(task_id)
         if not config:
@@ -86,21 +253,26 @@ class TestCaseAPI:
             return "1.1.in" in files and "1.1.out" in files
 
     @staticmethod
-    @cached(ttl=5)
+    @cached_per_task
+    async def get_test_case_count(task_id: str) -> int:
+        """Number of test cases, not counting sample test cases (subtask 0)."""
+        return sum(1 for f in get_files(task_id) if re.fullmatch(r"[1-9]\d*\.\d+\.in", f))
+
+    @staticmethod
+    @cached_per_task
     async def package_exists(task_id: str) -> bool:
         return bool(get_package_path(task_id))
 
     @staticmethod
-    @cached(ttl=5)
+    @cached_per_task
     async def get_sample_test_cases(task_id: str) -> List[SampleTestCase]:
+        manifest = _get_task_manifest(task_id)
+        if not manifest:
+            return []
         dir_path = os.path.join("test_cases", task_id)
         cases = []
-        files = get_files(task_id)
-
-        for i in count(1):
-            if f"0.{i}.in" not in files or f"0.{i}.out" not in files:
-                break
 
+        for i in range(1, manifest.sample_test_case_count + 1):
             case_in = await read_file(os.path.join(dir_path, f"0.{i}.in"))
             case_out = await read_file(os.path.join(dir_path, f"0.{i}.out"))
             if case_in.endswith("\n"):
@@ -111,7 +283,7 @@ class TestCaseAPI:
             case_in = case_in.replace("\n", "<br>")
             case_out = case_out.replace("\n", "<br>")
 
-            if f"0.{i}.txt" in files:
+            if f"0.{i}.txt" in manifest.files:
                 desc = await read_file(os.path.join(dir_path, f"0.{i}.txt"))
             else:
                 desc = None
@@ -1,5 +1,6 @@
 import asyncio
-from typing import List, Union
+from datetime import datetime, timedelta
+from typing import Union
 
 from pytz import utc
 from quart import (
@@ -8,21 +9,32 @@ from quart import (
 )
 from quart_auth import current_user
 from tortoise.expressions import F
-from tortoise.fields import ReverseRelation
 from tortoise.functions import Count
 
 from wykoj import bcrypt
-from wykoj.api import JudgeAPI
+from wykoj.api import JudgeAPI, JudgeQueue
 from wykoj.blueprints.api.judge import recalculate_contest_task_points
 from wykoj.blueprints.utils.access import admin_only
-from wykoj.blueprints.utils.misc import get_page, remove_pfps, save_picture
+from wykoj.blueprints.utils.archive import SubmissionArchiving
+from wykoj.blueprints.utils.compression import TestCaseResultPacking, TextCompression
+from wykoj.blueprints.utils.leaderboard import invalidate_leaderboards
+from wykoj.blueprints.utils.misc import (
+    get_page, invalidate_running_contest, remove_pfps, save_picture
+)
 from wykoj.blueprints.utils.pagination import Pagination
-from wykoj.constants import Verdict, hkt
+from wykoj.blueprints.utils.rejudge import (
+    StaleRejudge, recalc_contest_task_points, rejudge_submissions, reset_submission
+)
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
+from wykoj.blueprints.utils.solves import SolveRecalculation
+from wykoj.constants import JUDGE_PRIORITY_TRANS, JudgePriority, Verdict, hkt
 from wykoj.forms.admin import (
     AdminResetPasswordForm, ContestForm, NewContestForm,
     NewNonStudentUserForm, NewStudentUserForm, SidebarForm, TaskForm, UserForm
 )
-from wykoj.models import Contest, ContestParticipation, Sidebar, Submission, Task, User
+from wykoj.models import (
+    Contest, ContestParticipation, DailySolves, Sidebar, Submission, Task, User
+)
 
 admin = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -30,7 +42,17 @@ admin = Blueprint("admin", __name__, url_prefix="/admin")
 @admin.route("/")
 @admin_only
 async def home() -> str:
-    return await render_template("admin/home.html", title="Home")
+    return await render_template(
+        "admin/home.html",
+        title="Home",
+        recalc_status=SolveRecalculation.status,
+        compression_status=TextCompression.status,
+        packing_status=TestCaseResultPacking.status,
+        archiving_status=SubmissionArchiving.status,
+        stale_rejudge_status=StaleRejudge.status,
+        auto_rejudge=current_app.config.get("AUTO_REJUDGE", False),
+        archive_after_days=current_app.config.get("ARCHIVE_AFTER_DAYS", 365)
+    )
 
 
 @admin.route("/sidebar", methods=["GET", "POST"])
@@ -129,6 +151,7 @@ async def task_page(task_id: str) -> Union[Response, str]:
 
         await task.authors.clear()
         await task.authors.add(*authors)
+        invalidate_running_contest()  # Its tasks are cached with it
 
         await flash(f"Task {task.task_id} updated.", "success")
         return redirect(url_for("admin.tasks"))
@@ -155,7 +178,8 @@ async def delete_task(task_id: str) -> Response:
     if not task:
         abort(404)
     await task.delete()  # Submissions are cascade deleted
-    asyncio.create_task(_recalc_solves())
+    invalidate_running_contest()
+    SolveRecalculation.schedule()
     await flash("Task deleted.", "success")
     return redirect(url_for("admin.tasks"))
 
@@ -233,6 +257,8 @@ async def user_page(username: str) -> Union[Response, str]:
         user.is_student = user_form.is_student.data
         user.is_admin = user_form.is_admin.data
         await user.save()
+        ContestScoreboard.update_contestant(user)
+        invalidate_leaderboards()
 
         # Delete old profile pics if they were not the default pics
         if fn_40 and old_fn_40 != "default_40.png":
@@ -272,6 +298,9 @@ async def delete_user(username: str) -> Response:
     if not user:
         abort(404)
     await user.delete()  # Submissions are cascade deleted
+    Contest.invalidate_contestants()
+    ContestScoreboard.invalidate_all()
+    invalidate_leaderboards()
     await flash("User deleted.", "success")
     return redirect(url_for("admin.users"))
 
@@ -287,6 +316,8 @@ async def reset_profile(username: str) -> Response:
     user.img_40 = "default_40.png"
     user.img_160 = "default_160.png"
     await user.save()
+    ContestScoreboard.update_contestant(user)
+    invalidate_leaderboards()
 
     # Delete old profile pics if they were not the default pics
     if old_fn_40 != "default_40.png":
@@ -296,17 +327,6 @@ async def reset_profile(username: str) -> Response:
     return redirect(url_for("admin.users"))
 
 
-async def reset_submission(submission: Submission) -> None:
-    submission.verdict = Verdict.PENDING
-    submission.score = 0
-    submission._subtask_scores = None
-    submission.time_used = None
-    submission.memory_used = None
-    submission.first_solve = False
-    await submission.save()
-    await submission.test_case_results.all().delete()
-
-
 @admin.route("/submission/<int:submission_id>/rejudge", methods=["POST"])
 @admin_only
 async def rejudge_submission(submission_id: int) -> Response:
@@ -317,29 +337,18 @@ async def rejudge_submission(submission_id: int) -> Response:
     if submission.first_solve:
         await asyncio.gather(
             Task.filter(id=submission.task.id).update(solves=F("solves") - 1),
-            User.filter(id=submission.author.id).update(solves=F("solves") - 1)
+            User.filter(id=submission.author.id).update(solves=F("solves") - 1),
+            DailySolves.add(submission.author_id, submission.time, -1)
         )
+        invalidate_leaderboards()
     await reset_submission(submission)
+    await recalc_contest_task_points([submission])
 
-    current_app.add_background_task(JudgeAPI.judge_submission, submission)
+    await JudgeQueue.enqueue(submission, priority=JudgePriority.REJUDGE)
     await flash("Rejudging submission...", "success")
     return redirect(url_for("main.submission_page", submission_id=submission.id))
 
 
-async def _rejudge_submissions(
-    submissions: Union[List[Submission], ReverseRelation[Submission]]
-) -> None:
-    await asyncio.gather(
-        *[submission.fetch_related("task", "author") for submission in submissions]
-    )
-    submissions = sorted(submissions, key=lambda s: s.id)
-
-    await asyncio.gather(*[reset_submission(submission) for submission in submissions])
-    for submission in submissions:
-        current_app.add_background_task(JudgeAPI.judge_submission, submission)
-    await _recalc_solves()
-
-
 @admin.route("/task/<string:task_id>/rejudge", methods=["POST"])
 @admin_only
 async def rejudge_task_submissions(task_id: str) -> Response:
@@ -347,7 +356,7 @@ async def rejudge_task_submissions(task_id: str) -> Response:
     if not task:
         abort(404)
 
-    asyncio.create_task(_rejudge_submissions(task.submissions))
+    asyncio.create_task(rejudge_submissions(task.submissions))
     await flash("Rejudging submissions...", "success")
     return redirect(url_for("main.task.submissions_page", task_id=task.task_id))
 
@@ -359,7 +368,7 @@ async def rejudge_contest_submissions(contest_id: int) -> Response:
     if not contest:
         abort(404)
 
-    asyncio.create_task(_rejudge_submissions(contest.submissions))
+    asyncio.create_task(rejudge_submissions(contest.submissions))
     await flash("Rejudging submissions...", "success")
     return redirect(url_for("main.contest.submissions_page", contest_id=contest.id))
 
@@ -367,43 +376,63 @@ async def rejudge_contest_submissions(contest_id: int) -> Response:
 @admin.route("/recalc_solves", methods=["POST"])
 @admin_only
 async def recalc_solves() -> Response:
-    asyncio.create_task(_recalc_solves())
+    SolveRecalculation.schedule()
     await flash("Recalculating solves.", "success")
     return redirect(url_for("admin.home"))
 
 
-async def _recalc_solves() -> None:
-    async def _recalc_task_solves(task: Task) -> None:
-        task.solves = await task.submissions.filter(first_solve=True).count()
-        await task.save()
+@admin.route("/compress_text", methods=["POST"])
+@admin_only
+async def compress_text() -> Response:
+    if TextCompression.schedule():
+        await flash("Compressing stored text.", "success")
+    else:
+        await flash("Stored text is already being compressed.", "danger")
+    return redirect(url_for("admin.home"))
 
-    async def _recalc_user_solves(user: User) -> None:
-        user.solves = await user.submissions.filter(first_solve=True).count()
-        await user.save()
 
-    async for task in Task.all().prefetch_related("submissions"):
-        asyncio.create_task(_recalc_task_solves(task))
-    async for user in User.all().prefetch_related("submissions"):
-        asyncio.create_task(_recalc_user_solves(user))
+@admin.route("/pack_test_case_results", methods=["POST"])
+@admin_only
+async def pack_test_case_results() -> Response:
+    if TestCaseResultPacking.schedule():
+        await flash("Packing test case results.", "success")
+    else:
+        await flash("Test case results are already being packed.", "danger")
+    return redirect(url_for("admin.home"))
+
+
+@admin.route("/archive_submissions", methods=["POST"])
+@admin_only
+async def archive_submissions() -> Response:
+    max_age = timedelta(days=current_app.config.get("ARCHIVE_AFTER_DAYS", 365))
+    if SubmissionArchiving.schedule(max_age):
+        await flash("Archiving old submissions.", "success")
+    else:
+        await flash("Old submissions are already being archived.", "danger")
+    return redirect(url_for("admin.home"))
 
 
 async def _delete_submission(submission: Submission) -> None:
     first_solve = submission.first_solve
     await submission.delete()
     if first_solve:
+        await DailySolves.add(submission.author_id, submission.time, -1)
         solve = await Submission.filter(
             task_id=submission.task_id, author_id=submission.author_id, verdict=Verdict.ACCEPTED
         ).order_by("id").first()  # Previous solve
         if solve:
             solve.first_solve = True
             await solve.save()
+            await DailySolves.add(solve.author_id, solve.time)
         else:
             await asyncio.gather(
                 Task.filter(id=submission.task_id).update(solves=F("solves") - 1),
                 User.filter(id=submission.author_id).update(solves=F("solves") - 1)
             )
+        invalidate_leaderboards()
 
     if submission.contest:
+        ContestScoreboard.invalidate(submission.contest_id)
         contest_participation = [
             cp for cp in submission.contest.participations
             if cp.contestant_id == submission.author_id
@@ -471,6 +500,7 @@ async def new_contest() -> Union[Response, str]:
             duration=form.duration.data
         )
         await contest.tasks.add(*tasks)
+        invalidate_running_contest()
 
         await flash("Contest created.", "success")
         return redirect(url_for("admin.contests"))
@@ -525,6 +555,9 @@ async def contest_page(contest_id: int) -> Union[Response, str]:
             coros.append(ContestParticipation(contest=contest, contestant=user).save())
         if coros:
             await asyncio.gather(*coros)
+        Contest.invalidate_contestants(contest.id)
+        ContestScoreboard.invalidate(contest.id)
+        invalidate_running_contest()
         await flash("Contest updated.", "success")
         return redirect(url_for("admin.contests"))
     elif request.method == "GET":
@@ -549,10 +582,40 @@ async def delete_contest(contest_id: int) -> Response:
     if not contest:
         abort(404)
     await contest.delete()
+    Contest.invalidate_contestants(contest.id)
+    ContestScoreboard.invalidate(contest.id)
+    invalidate_running_contest()
     await flash("Contest deleted.", "success")
     return redirect(url_for("admin.contests"))
 
 
+@admin.route("/judge_queue")
+@admin_only
+async def judge_queue() -> str:
+    """Judge hosts, and queued submissions in dispatch order with waiting times per class."""
+    now = datetime.now(utc)
+    stats = await JudgeQueue.get_stats()
+    jobs = (await JudgeQueue.get_dispatch_order(now))[:50]
+    submissions = await Submission.filter(id__in=[job["submission_id"] for job in jobs]
+                                          ).prefetch_related("task", "author")
+    submissions = {submission.id: submission for submission in submissions}
+    queued = [
+        {
+            "submission": submissions[job["submission_id"]],
+            "priority": job["priority"],
+            "wait": (now - job["queue_time"]).total_seconds()
+        } for job in jobs if job["submission_id"] in submissions
+    ]
+    return await render_template(
+        "admin/judge_queue.html",
+        title="Judge Queue",
+        hosts=JudgeAPI.get_hosts(),
+        stats=stats,
+        queued=queued,
+        priority_names=JUDGE_PRIORITY_TRANS
+    )
+
+
 @admin.route("/guide")
 @admin_only
 async def guide() -> str:
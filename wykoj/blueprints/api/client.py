@@ -1,12 +1,18 @@
+import asyncio
 import logging
 from collections import Counter
+from datetime import datetime, timedelta
+from typing import AsyncGenerator
 
+import ujson as json
+from pytz import utc
 from quart import Blueprint, Response, abort, jsonify, request
 from quart_auth import current_user
 from tortoise.expressions import Q
 from tortoise.functions import Count
 
-from wykoj.constants import ContestStatus
+from wykoj.api import SubmissionEvents
+from wykoj.constants import ContestStatus, Verdict
 from wykoj.models import Contest, Submission, Task, User
 
 client_side_api_blueprint = Blueprint("client_side", __name__, url_prefix="/api")
@@ -41,11 +47,12 @@ async def user_data(username: str) -> Response:
 
     # Distribution of languages used in user submissions to build doughnut chart
     # Not much point in excluding submissions to non-public tasks
-    languages = await user.submissions.all().annotate(
-        count=Count("id")
-    ).group_by("language").values("language", "count")
-
-    counter = Counter({d["language"]: d["count"] for d in languages})
+    counter = Counter()
+    for submissions in (user.submissions, user.archived_submissions):
+        languages = await submissions.all().annotate(
+            count=Count("id")
+        ).group_by("language").values("language", "count")
+        counter.update({d["language"]: d["count"] for d in languages})
     if len(counter) > 10:
         data = counter.most_common(9)
         data.append(("Other", sum(counter.values()) - sum(dict(data).values())))
@@ -63,7 +70,47 @@ async def submission_data(submission_id: int) -> Response:
     if not submission:
         abort(404)
 
-    return jsonify(timestamp=submission.time.timestamp(), verdict=submission.verdict)
+    data = {"timestamp": submission.time.timestamp(), "verdict": submission.verdict}
+    if submission.verdict == Verdict.PENDING:
+        # Test cases reported so far, by incremental reports from the judge
+        data["test_cases_judged"] = await submission.test_case_results.all().count()
+    return jsonify(**data)
+
+
+@client_side_api_blueprint.route("/submission/<int:submission_id>/events")
+async def submission_events(submission_id: int) -> Response:
+    """
+    Server-sent events of a pending submission: judging progress, then its verdict.
+    Updates are pushed as the judge reports them, so open pages need not poll.
+    """
+    if not await Submission.exists(id=submission_id):
+        abort(404)
+
+    async def stream() -> AsyncGenerator[str, None]:
+        async with SubmissionEvents.subscribe(submission_id) as queue:
+            # Read after subscribing, so that no update in between is missed
+            submission = await Submission.filter(id=submission_id).first()
+            data = {"timestamp": submission.time.timestamp(), "verdict": submission.verdict}
+            yield f"data: {json.dumps(data)}\n\n"
+
+            # Give up 5 minutes after submission like polling does, the client then stops too
+            deadline = submission.time + timedelta(minutes=5)
+            while data.get("verdict", Verdict.PENDING) == Verdict.PENDING:
+                timeout = (deadline - datetime.now(utc)).total_seconds()
+                if timeout <= 0:
+                    return
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=min(timeout, 15))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"  # Keeps proxies from closing an idle connection
+                else:
+                    yield f"data: {json.dumps(data)}\n\n"
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Stop nginx buffering events
+    response.timeout = None
+    return response
 
 
 @client_side_api_blueprint.route("/contest/<int:contest_id>")
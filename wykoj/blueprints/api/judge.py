@@ -1,18 +1,23 @@
-import asyncio
 import logging
 import traceback
 from datetime import datetime
 from decimal import Decimal
+from typing import Any, Dict, List, Optional
 
 from pytz import utc
 from quart import Blueprint, Response, abort, jsonify, request
-from tortoise.expressions import F
+from tortoise.expressions import F, Q
+from tortoise.transactions import in_transaction
 
-from wykoj.api import TestCaseAPI
+from wykoj.api import JudgeAPI, JudgeQueue, SubmissionEvents, TestCaseAPI
 from wykoj.blueprints.utils.access import backend_only
+from wykoj.blueprints.utils.leaderboard import invalidate_leaderboards
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
+from wykoj.blueprints.utils.solves import SolveRecalculation
 from wykoj.constants import Verdict
 from wykoj.models import (
-    ContestParticipation, ContestTaskPoints, Submission, Task, TestCaseResult, User
+    ArchivedSubmission, ContestParticipation, ContestTaskPoints, DailySolves, PackedTestCaseResults,
+    Submission, Task, TestCaseResult, User
 )
 
 judge_api_blueprint = Blueprint("judge", __name__)
@@ -23,16 +28,86 @@ class JudgeSystemError(Exception):
     """Raised when judging a submission fails."""
 
 
+@judge_api_blueprint.route("/task_info/<string:payload_hash>")
+@backend_only
+async def task_info(payload_hash: str) -> Response:
+    """Task payload by content hash, for judges dispatched a hash they have not cached."""
+    payload = JudgeAPI.get_task_payload(payload_hash)
+    if not payload:
+        abort(404)
+    return jsonify(**payload)
+
+
+async def save_test_case_results(submission: Submission, results: List[Dict[str, Any]]) -> None:
+    """
+    Save reported test case results, replacing any earlier report of the same test cases.
+    Run in a transaction, so that a failed insert does not lose the replaced results.
+    """
+    test_case_results = [
+        TestCaseResult(
+            subtask=tcr["subtask"],
+            test_case=tcr["test_case"],
+            verdict=tcr["verdict"],
+            score=tcr["score"],
+            time_used=tcr["time_used"],
+            memory_used=tcr["memory_used"],
+            submission=submission
+        ) for tcr in results
+    ]
+    if not test_case_results:
+        return  # An empty Q() would match, and delete, every result saved so far
+    reported = Q()
+    for tcr in test_case_results:
+        reported |= Q(subtask=tcr.subtask, test_case=tcr.test_case)
+    await submission.test_case_results.filter(reported).delete()
+    await TestCaseResult.bulk_create(test_case_results)
+
+
+@judge_api_blueprint.route("/submission/<int:submission_id>/report/partial", methods=["POST"])
+@backend_only
+async def report_partial_submission_result(submission_id: int) -> Response:
+    """Results of test cases judged so far, reported while the rest are still being judged."""
+    submission = await Submission.filter(id=submission_id).first()
+    if not submission:
+        abort(404)
+    if submission.verdict != Verdict.PENDING:
+        return jsonify(success=False)  # Late report of a submission already finalised
+    if not await JudgeQueue.owns_job(submission_id, request.headers.get("X-Judge-Host")):
+        return jsonify(success=False)  # Sent to another host meanwhile
+
+    data = await request.get_json(silent=True)
+    results = data.get("test_case_results") if isinstance(data, dict) else None
+    if not isinstance(results, list):
+        logger.error(f"[Backend] Malformed partial report for submission {submission_id}")
+        return jsonify(success=False)
+    try:
+        async with in_transaction():
+            await save_test_case_results(submission, results)
+    except (KeyError, TypeError):
+        logger.error(f"[Backend] Malformed partial report for submission {submission_id}")
+        return jsonify(success=False)
+    SubmissionEvents.publish(
+        submission_id, test_cases_judged=await submission.test_case_results.all().count()
+    )
+    return jsonify(success=True)
+
+
 @judge_api_blueprint.route("/submission/<int:submission_id>/report", methods=["POST"])
 @backend_only
 async def report_submission_result(submission_id: int) -> Response:
     logger.info(f"[Backend] Report results for submission {submission_id}")
 
-    submission = await Submission.filter(
-        id=submission_id
-    ).prefetch_related("task", "author", "contest__participations").first()
+    submission = await Submission.filter(id=submission_id).prefetch_related("task",
+                                                                            "author").first()
     if not submission:
         abort(404)
+    judge_host = request.headers.get("X-Judge-Host")
+    if not await JudgeQueue.owns_job(submission_id, judge_host):
+        logger.warning(
+            f"[Backend] Ignored report for submission {submission_id} from {judge_host}, "
+            "which no longer judges it"
+        )
+        return jsonify(success=False)
 
     try:
         config = await TestCaseAPI.get_config(submission.task.task_id)
@@ -46,87 +121,43 @@ async def report_submission_result(submission_id: int) -> Response:
             else:
                 logger.error("What are you doing Snuny")
                 submission.verdict = Verdict.SYSTEM_ERROR
-            await submission.save()
+            await submission.save(update_fields=["verdict"])
         else:
-            test_case_results = [
-                TestCaseResult(
-                    subtask=tcr["subtask"],
-                    test_case=tcr["test_case"],
-                    verdict=tcr["verdict"],
-                    score=tcr["score"],
-                    time_used=tcr["time_used"],
-                    memory_used=tcr["memory_used"],
-                    submission=submission
-                ) for tcr in data["test_case_results"]
-            ]
-
-            # Determine overall verdict
-            submission.verdict = Verdict.ACCEPTED  # Temporary value
-            for test_case_result in test_case_results:
-                if (
-                    submission.verdict == Verdict.ACCEPTED
-                    and test_case_result.verdict != Verdict.ACCEPTED
-                    or submission.verdict == Verdict.PARTIAL_SCORE
-                    and test_case_result.verdict not in (Verdict.ACCEPTED, Verdict.PARTIAL_SCORE)
-                ):
-                    submission.verdict = test_case_result.verdict
-
-            # Determine overall score
-            if config["batched"]:
-                # Lowest score per subtask
-                tcr_per_subtask = [[] for _ in range(len(config["points"]))]
-                for test_case_result in test_case_results:
-                    tcr_per_subtask[test_case_result.subtask - 1].append(test_case_result)
-
-                # Do not use submission.subtask_scores as a list directly
-                subtask_scores = []
-                for i in range(len(config["points"])):
-                    subtask_min_score = min(
-                        test_case_result.score for test_case_result in tcr_per_subtask[i]
-                    )
-                    subtask_scores.append(subtask_min_score * (Decimal(config["points"][i]) / 100))
-                submission.subtask_scores = subtask_scores
-                submission.score = sum(subtask_scores)
-            else:
-                # Mean score of all test cases
-                submission.score = (
-                    sum(tcr.score for tcr in test_case_results) / len(test_case_results)
-                )
-
-            if submission.verdict == Verdict.ACCEPTED:
-                submission.time_used = max(tcr.time_used for tcr in test_case_results)
-                submission.memory_used = max(tcr.memory_used for tcr in test_case_results)
-
-                # Determine if submission is first solve
-                submission.first_solve = await Submission.filter(
-                    task=submission.task, author=submission.author, first_solve=True
-                ).count() == 0
+            # The whole report is applied atomically, so a failure part way never leaves
+            # solve counts or contest points out of step with the submission
+            async with in_transaction():
+                await apply_test_case_results(submission, config, data.get("test_case_results"))
+            # Only caches are updated past this point, so that a failure does not mark the
+            # committed report SE
+            try:
+                await ContestScoreboard.record_submission(submission)
                 if submission.first_solve:
-                    await asyncio.gather(
-                        Task.filter(id=submission.task.id).update(solves=F("solves") + 1),
-                        User.filter(id=submission.author.id).update(solves=F("solves") + 1)
-                    )
-
-            await submission.save()
-            await asyncio.gather(*[tcr.save() for tcr in test_case_results])
-
-            # Prefetch contest-related info
-            if submission.contest:
-                contest_participation = [
-                    cp for cp in submission.contest.participations
-                    if cp.contestant_id == submission.author_id
-                ][0]
-                await contest_participation.fetch_related("task_points")
-                await recalculate_contest_task_points(contest_participation, submission.task)
+                    invalidate_leaderboards()
+            except Exception as e:
+                logger.error(
+                    f"Error updating caches with submission {submission_id} results:\n" +
+                    "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                )
+                if submission.contest_id:
+                    ContestScoreboard.invalidate(submission.contest_id)
+                invalidate_leaderboards()
     except Exception as e:
         logger.error(
             f"Error processing submission {submission_id} results:\n" +
-            "".join(traceback.format_exception(etype=type(e), value=e, tb=e.__traceback__))
+            "".join(traceback.format_exception(type(e), e, e.__traceback__))
         )
         logger.error(f"Marked SE for submission {submission_id}")
         submission.verdict = Verdict.SYSTEM_ERROR
-        await submission.save()
+        await Submission.filter(id=submission_id).update(verdict=Verdict.SYSTEM_ERROR)
         return jsonify(success=False)
+    finally:
+        if (
+            await JudgeQueue.complete(submission_id, judge_host)
+            and not SolveRecalculation.deferred
+        ):
+            # Rejudges may have moved first solves, which reports alone do not fix
+            SolveRecalculation.schedule()
+        SubmissionEvents.publish(submission_id, verdict=submission.verdict)
 
     judge_duration = (datetime.now(utc) - submission.time).total_seconds()
     logger.info(
@@ -137,15 +168,131 @@ async def report_submission_result(submission_id: int) -> Response:
     return jsonify(success=True)
 
 
+async def apply_test_case_results(
+    submission: Submission, config: Dict[str, Any], results: Optional[List[Dict[str, Any]]]
+) -> None:
+    """Finalise a judged submission from its test case results. Run in a transaction."""
+    # Results may have been reported incrementally already, in which case the final
+    # report carries none or only the remaining ones
+    if results:
+        await save_test_case_results(submission, results)
+    test_case_results = await submission.test_case_results.all()
+
+    # Determine overall verdict
+    submission.verdict = Verdict.ACCEPTED  # Temporary value
+    for test_case_result in test_case_results:
+        if (
+            submission.verdict == Verdict.ACCEPTED
+            and test_case_result.verdict != Verdict.ACCEPTED
+            or submission.verdict == Verdict.PARTIAL_SCORE
+            and test_case_result.verdict not in (Verdict.ACCEPTED, Verdict.PARTIAL_SCORE)
+        ):
+            submission.verdict = test_case_result.verdict
+
+    # Determine overall score
+    if config["batched"]:
+        # Lowest score per subtask
+        tcr_per_subtask = [[] for _ in range(len(config["points"]))]
+        for test_case_result in test_case_results:
+            tcr_per_subtask[test_case_result.subtask - 1].append(test_case_result)
+
+        # Do not use submission.subtask_scores as a list directly
+        subtask_scores = []
+        for i in range(len(config["points"])):
+            subtask_min_score = min(
+                test_case_result.score for test_case_result in tcr_per_subtask[i]
+            )
+            subtask_scores.append(subtask_min_score * (Decimal(config["points"][i]) / 100))
+        submission.subtask_scores = subtask_scores
+        submission.score = sum(subtask_scores)
+    else:
+        # Mean score of all test cases
+        submission.score = (
+            sum(tcr.score for tcr in test_case_results) / len(test_case_results)
+        )
+
+    if submission.verdict == Verdict.ACCEPTED:
+        submission.time_used = max(tcr.time_used for tcr in test_case_results)
+        submission.memory_used = max(tcr.memory_used for tcr in test_case_results)
+
+        # Lock the author's row until commit, so that of two accepted submissions to the
+        # same task reported together, only the first is counted as a first solve
+        await User.filter(id=submission.author_id).select_for_update().first()
+        submission.first_solve = not await Submission.exists(
+            task_id=submission.task_id, author_id=submission.author_id, first_solve=True
+        )
+        if submission.first_solve:
+            await Task.filter(id=submission.task_id).update(solves=F("solves") + 1)
+            await User.filter(id=submission.author_id).update(solves=F("solves") + 1)
+            await DailySolves.add(submission.author_id, submission.time)
+
+    await submission.save(
+        update_fields=[
+            "verdict", "score", "_subtask_scores", "time_used", "memory_used", "first_solve"
+        ]
+    )
+    await PackedTestCaseResults.replace_rows(submission.id, test_case_results)
+
+    if submission.contest_id:
+        # Locked like the author above, so concurrent reports of the contestant merge in turn
+        contest_participation = await ContestParticipation.filter(
+            contest_id=submission.contest_id, contestant_id=submission.author_id
+        ).select_for_update().first()
+        if contest_participation:
+            await merge_contest_task_points(contest_participation, submission, config)
+
+
+async def merge_contest_task_points(
+    contest_participation: ContestParticipation, submission: Submission, config: Dict[str, Any]
+) -> None:
+    """
+    Update contest task points with a newly judged submission, taking the maximum of each
+    subtask. Points only ever rise this way, so after deleting or rejudging submissions
+    use recalculate_contest_task_points instead.
+    """
+    task_points = await ContestTaskPoints.filter(
+        participation_id=contest_participation.id, task_id=submission.task_id
+    ).first()
+    if config["batched"]:  # Cumulative subtask score
+        new_points = submission.subtask_scores
+    else:  # Maximum submission score
+        new_points = [submission.score]
+
+    if not task_points:
+        task_points = ContestTaskPoints(
+            task_id=submission.task_id, participation_id=contest_participation.id
+        )
+        task_points.points = new_points
+    elif len(task_points.points) != len(new_points):
+        # Subtasks changed since the points were last calculated
+        await contest_participation.fetch_related("task_points")
+        await recalculate_contest_task_points(contest_participation, submission.task)
+        return
+    else:
+        merged = [max(old, new) for old, new in zip(task_points.points, new_points)]
+        if merged == task_points.points:
+            return  # No higher than before, nothing to write
+        task_points.points = merged
+
+    await task_points.save()
+
+
 async def recalculate_contest_task_points(
     contest_participation: ContestParticipation, task: Task
 ) -> None:
     config = await TestCaseAPI.get_config(task.task_id)
-    submissions = await Submission.filter(
-        task_id=task.id,
-        author_id=contest_participation.contestant_id,
-        contest_id=contest_participation.contest_id
-    )
+    # Archived submissions count towards points just the same
+    submissions = [
+        *await Submission.filter(
+            task_id=task.id,
+            author_id=contest_participation.contestant_id,
+            contest_id=contest_participation.contest_id
+        ), *await ArchivedSubmission.filter(
+            task_id=task.id,
+            author_id=contest_participation.contestant_id,
+            contest_id=contest_participation.contest_id
+        )
+    ]
 
     for task_points in contest_participation.task_points:
         if task_points.task_id == task.id:
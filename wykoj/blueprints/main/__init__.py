@@ -1,15 +1,13 @@
 import asyncio
 import logging
 from collections import Counter, defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime
 from itertools import groupby
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Union
 
-from aiocache import cached
 from pytz import utc
 from quart import Blueprint, Response, abort, flash, redirect, render_template, request, url_for
 from quart_auth import current_user, login_required, login_user, logout_user
-from tortoise.expressions import Q
 from tortoise.functions import Count
 
 from wykoj import __version__, bcrypt
@@ -18,18 +16,23 @@ from wykoj.blueprints.main.contest import contest_blueprint
 from wykoj.blueprints.main.task import task_blueprint
 from wykoj.blueprints.main.user import user_blueprint
 from wykoj.blueprints.utils.access import contest_redirect
+from wykoj.blueprints.utils.leaderboard import get_leaderboards, invalidate_leaderboards
+from wykoj.blueprints.utils.loader import get_loader
 from wykoj.blueprints.utils.misc import (
-    get_page, get_recent_solves, get_running_contest, is_safe_url, remove_pfps, save_picture
+    filter_submissions, get_page, get_recent_solves, is_safe_url, remove_pfps, save_picture
 )
-from wykoj.blueprints.utils.pagination import Pagination
+from wykoj.blueprints.utils.pagination import Pagination, get_approximate_count, paginate_by_id
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
 from wykoj.constants import (
     ContestStatus, TASK_CATEGORIES, TASK_CATEGORY_LETTERS, TASK_CATEGORY_SLUGS, Verdict
 )
 from wykoj.forms.main import (
-    ExtraSettingsForm, LoginForm, NonStudentSettingsForm, ResetPasswordForm, StudentSettingsForm
+    ExtraSettingsForm, LoginForm, NonStudentSettingsForm, ResetPasswordForm, StudentSettingsForm,
+    SubmissionFilterForm
 )
 from wykoj.models import (
-    Contest, ContestParticipation, Sidebar, Submission, Task, User, UserWrapper
+    ArchivedSubmission, Contest, ContestParticipation, Sidebar, Submission, SubmissionSource, Task,
+    User, UserWrapper
 )
 
 logger = logging.getLogger(__name__)
@@ -75,7 +78,7 @@ async def home() -> str:
     sidebar, recent_solves, ongoing_contest, upcoming_contests = await asyncio.gather(
         Sidebar.get(),
         get_recent_solves(),
-        get_running_contest(),
+        get_loader().get_running_contest(),
         Contest.filter(start_time__gte=current_time).order_by("start_time")
     )
 
@@ -159,18 +162,22 @@ async def submissions() -> str:
         submissions = Submission.all()
     else:
         submissions = Submission.filter(task__is_public=True)
-    cnt = await submissions.count()
-    page = get_page()
-    submissions = await submissions.offset(
-        (page - 1) * 50
-    ).limit(50).prefetch_related("task", "author", "contest")
-    pagination = Pagination(submissions, page=page, per_page=50, total=cnt)
+    form = SubmissionFilterForm(formdata=request.args)
+    submissions, filters = await filter_submissions(submissions, form)
+    total = await get_approximate_count(
+        f"submissions:{current_user.is_admin}:{filters}", submissions
+    )
+    submissions, pagination = await paginate_by_id(
+        submissions.prefetch_related("task", "author", "contest"), per_page=50, total=total
+    )
     return await render_template(
         "submissions.html",
         title="Submissions",
+        form=form,
+        filters=filters,
         submissions=submissions,
         pagination=pagination,
-        show_pagination=cnt > 50
+        show_pagination=pagination.has_newer or pagination.has_older
     )
 
 
@@ -178,16 +185,23 @@ async def submissions() -> str:
 async def submission_page(submission_id: int) -> str:
     submission = await Submission.filter(
         id=submission_id
-    ).prefetch_related("task", "author", "test_case_results", "contest").first()
+    ).prefetch_related("task", "author", "contest").first()
+    archived = not submission
+    if archived:
+        submission = await ArchivedSubmission.filter(
+            id=submission_id
+        ).prefetch_related("task", "author", "contest").first()
     if not submission:
         abort(404)
 
-    contest = await get_running_contest()
+    loader = get_loader()
+    contest = await loader.get_running_contest()
     if not (
         current_user.is_admin or submission.task.is_public
-        and not (contest and await contest.is_contestant(current_user))
+        and not (contest and await loader.is_contestant(contest, current_user))
         or contest and contest.status == ContestStatus.ONGOING and submission.task in contest.tasks
-        and await contest.is_contestant(current_user) and submission.author.id == current_user.id
+        and await loader.is_contestant(contest, current_user)
+        and submission.author.id == current_user.id
     ):
         abort(404)
 
@@ -211,68 +225,29 @@ async def submission_page(submission_id: int) -> str:
         "submission.html",
         title=f"Submission {submission.id}",
         submission=submission,
+        test_case_results=await submission.get_test_case_results(),
         config=await TestCaseAPI.get_config(submission.task.task_id),
+        test_case_count=await TestCaseAPI.get_test_case_count(submission.task.task_id),
         show_source_code=show_source_code,
+        source_code=(
+            None if not show_source_code else submission.source_code if archived else
+            await SubmissionSource.get_source_code(submission.id)
+        ),
+        archived=archived,
         neko_url=neko_url
     )
 
 
-def add_leaderboard_ranks(users: List[User], solves_attr: str) -> List[Tuple[int, User]]:
-    lb = []
-    rank = 1
-    for i in range(len(users)):
-        if i != 0 and getattr(users[i], solves_attr) < getattr(users[i - 1], solves_attr):
-            rank = i + 1
-        lb.append((rank, users[i]))
-    return lb
-
-
-@cached(ttl=3)
-async def get_all_time_leaderboard() -> List[Tuple[int, User]]:
-    users = await User.filter(Q(is_student=True) | Q(is_admin=True)).order_by("-solves", "id")
-    return add_leaderboard_ranks(users, "solves")
-
-
-@cached(ttl=3)
-async def get_monthly_leaderboard() -> List[Tuple[int, User]]:
-    monthly_solves = await Submission.annotate(count=Count("id")).filter(
-        time__gte=datetime.now(utc) - timedelta(days=30), first_solve=True
-    ).group_by("author_id").order_by("-count").values("author_id", "count")
-    monthly_solves = {e["author_id"]: e["count"] for e in monthly_solves}
-    users = await User.filter(Q(is_student=True) | Q(is_admin=True), id__in=monthly_solves)
-    for user in users:
-        user.monthly_solves = monthly_solves[user.id]
-    users.sort(key=lambda u: u.monthly_solves, reverse=True)
-    return add_leaderboard_ranks(users, "monthly_solves")
-
-
-@cached(ttl=3)
-async def get_weekly_leaderboard() -> List[Tuple[int, User]]:
-    weekly_solves = await Submission.annotate(count=Count("id")).filter(
-        time__gte=datetime.now(utc) - timedelta(days=7), first_solve=True
-    ).group_by("author_id").order_by("-count").values("author_id", "count")
-    weekly_solves = {e["author_id"]: e["count"] for e in weekly_solves}
-    users = await User.filter(Q(is_student=True) | Q(is_admin=True), id__in=weekly_solves)
-    for user in users:
-        user.weekly_solves = weekly_solves[user.id]
-    users.sort(key=lambda u: u.weekly_solves, reverse=True)
-    return add_leaderboard_ranks(users, "weekly_solves")
-
-
 @main.route("/leaderboard")
 @contest_redirect
 async def leaderboard() -> str:
-    all_time_leaderboard, monthly_leaderboard, weekly_leaderboard = await asyncio.gather(
-        get_all_time_leaderboard(),
-        get_monthly_leaderboard(),
-        get_weekly_leaderboard(),
-    )
+    leaderboards = await get_leaderboards()
     return await render_template(
         "leaderboard.html",
         title="Leaderboard",
-        all_time_leaderboard=all_time_leaderboard,
-        monthly_leaderboard=monthly_leaderboard,
-        weekly_leaderboard=weekly_leaderboard
+        all_time_leaderboard=leaderboards["all_time"],
+        monthly_leaderboard=leaderboards["monthly"],
+        weekly_leaderboard=leaderboards["weekly"]
     )
 
 
@@ -332,6 +307,8 @@ async def settings() -> Union[Response, str]:
         current_user.img_40 = fn_40 or current_user.img_40
         current_user.img_160 = fn_160 or current_user.img_160
         await current_user.save()
+        ContestScoreboard.update_contestant(current_user.user)
+        invalidate_leaderboards()
 
         # Delete old profile pics if they were not the default pics
         if fn_40 and old_fn_40 != "default_40.png":
@@ -1,15 +1,16 @@
 import asyncio
-from datetime import timedelta
-from statistics import mean, median, pstdev
 
 from quart import Blueprint, Response, abort, flash, g, redirect, render_template, request, url_for
 from quart_auth import current_user
 
 from wykoj.api import TestCaseAPI
 from wykoj.blueprints.utils.access import contest_redirect
-from wykoj.blueprints.utils.misc import get_page, get_running_contest
-from wykoj.blueprints.utils.pagination import Pagination
+from wykoj.blueprints.utils.loader import get_loader
+from wykoj.blueprints.utils.misc import filter_submissions
+from wykoj.blueprints.utils.pagination import get_approximate_count, paginate_by_id
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
 from wykoj.constants import ContestStatus
+from wykoj.forms.main import SubmissionFilterForm
 from wykoj.models import Contest, ContestParticipation
 
 contest_blueprint = Blueprint("contest", __name__, url_prefix="/contest/<int:contest_id>")
@@ -17,8 +18,8 @@ contest_blueprint = Blueprint("contest", __name__, url_prefix="/contest/<int:con
 
 @contest_blueprint.before_request
 async def before_request() -> None:
-    contest_id = request.view_args["contest_id"]
-    contest = await Contest.filter(id=contest_id).prefetch_related("tasks").first()
+    loader = get_loader()
+    contest = await loader.get_contest(request.view_args["contest_id"], "tasks")
     if not contest:
         abort(404)
 
@@ -27,26 +28,26 @@ async def before_request() -> None:
         # to be accessible by for non-admin non-contestants
         if not (
             contest.status == ContestStatus.ONGOING and
-            (current_user.is_admin or await contest.is_contestant(current_user))
+            (current_user.is_admin or await loader.is_contestant(contest, current_user))
             or contest.status == ContestStatus.ENDED and (
-                current_user.is_admin or await contest.is_contestant(current_user)
+                current_user.is_admin or await loader.is_contestant(contest, current_user)
                 or all(task.is_public for task in contest.tasks)
             )
         ):
             abort(404)
 
-    running_contest = await get_running_contest()
+    running_contest = await loader.get_running_contest()
     if (
         running_contest and contest != running_contest and not current_user.is_admin
-        and await running_contest.is_contestant(current_user)
+        and await loader.is_contestant(running_contest, current_user)
     ):
         abort(404)
 
     g.show_links = (
         contest.status == ContestStatus.ONGOING and
-        (current_user.is_admin or await contest.is_contestant(current_user))
+        (current_user.is_admin or await loader.is_contestant(contest, current_user))
         or contest.status == ContestStatus.ENDED and (
-            current_user.is_admin or await contest.is_contestant(current_user)
+            current_user.is_admin or await loader.is_contestant(contest, current_user)
             or all(task.is_public for task in contest.tasks)
         )
     )
@@ -54,9 +55,7 @@ async def before_request() -> None:
 
 @contest_blueprint.route("/")
 async def contest_page(contest_id: int) -> str:
-    contest = await Contest.filter(id=contest_id).prefetch_related(
-        "tasks", "participations__contestant", "participations__task_points__task"
-    ).first()
+    contest = await get_loader().get_contest(contest_id, "tasks", "participations__contestant")
 
     # Values for the template, which must not read a relation itself: it renders
     # in async mode, where reading a relation awaits it, and awaiting a relation
@@ -80,6 +79,7 @@ async def contest_page(contest_id: int) -> str:
             (cp for cp in contest.participations if cp.contestant_id == current_user.user.id), None
         )
         if contest_participation:
+            await contest_participation.fetch_related("task_points")
             total_points = sum(ctp.total_points for ctp in contest_participation.task_points)
             user_first_solves = await contest.submissions.filter(
                 author=current_user.user, first_solve=True
@@ -120,25 +120,8 @@ async def contest_page(contest_id: int) -> str:
         abort(451)
     points = [config["points"] if config["batched"] else [100] for config in configs]
 
-    # Calculate contest statistics
-    stats = {task.task_id: {"attempts": 0, "data": []} for task in contest_tasks}
-    stats["overall"] = {"attempts": 0, "data": []}
-    for cp in contest.participations:
-        if cp.task_points:
-            stats["overall"]["attempts"] += 1
-            # task_points is prefetched above; `await cp.total_points` would
-            # await it again and re-run its query
-            stats["overall"]["data"].append(sum(ctp.total_points for ctp in cp.task_points))
-            for ctp in cp.task_points:
-                stats[ctp.task.task_id]["attempts"] += 1
-                stats[ctp.task.task_id]["data"].append(ctp.total_points)
-    for key in stats:
-        stats[key]["max"] = max(stats[key]["data"], default="--")
-        stats[key]["max_cnt"] = stats[key]["data"].count(stats[key]["max"]
-                                                         ) if stats[key]["attempts"] else "--"
-        stats[key]["mean"] = mean(stats[key]["data"]) if stats[key]["attempts"] else "--"
-        stats[key]["median"] = median(stats[key]["data"]) if stats[key]["attempts"] else "--"
-        stats[key]["sd"] = pstdev(stats[key]["data"]) if stats[key]["attempts"] else "--"
+    # Contest statistics, only computed when shown
+    stats = (await ContestScoreboard.get(contest)).get_stats(contest_tasks) if show_stats else None
 
     return await render_template(
         "contest/contest.html",
@@ -160,15 +143,18 @@ async def contest_page(contest_id: int) -> str:
 @contest_blueprint.route("/join", methods=["POST"])
 @contest_redirect
 async def join(contest_id: int) -> Response:
-    contest = await Contest.filter(id=contest_id).first()
+    loader = get_loader()
+    contest = await loader.get_contest(contest_id)
     if not (
         contest.is_public and contest.status == ContestStatus.PRE_PREP
         and await current_user.is_authenticated and not current_user.is_admin
-        and not await contest.is_contestant(current_user)
+        and not await loader.is_contestant(contest, current_user)
     ):
         abort(400)
 
     await ContestParticipation.create(contest=contest, contestant=current_user.user)
+    Contest.invalidate_contestants(contest.id)
+    ContestScoreboard.invalidate(contest.id)
     await flash("Successfully joined.", "success")
     return redirect(url_for("main.contest.contest_page", contest_id=contest.id))
 
@@ -176,128 +162,78 @@ async def join(contest_id: int) -> Response:
 @contest_blueprint.route("/leave", methods=["POST"])
 @contest_redirect
 async def leave(contest_id: int) -> Response:
-    contest = await Contest.filter(id=contest_id).first()
+    loader = get_loader()
+    contest = await loader.get_contest(contest_id)
     if not (
         contest.is_public and contest.status == ContestStatus.PRE_PREP
         and await current_user.is_authenticated and not current_user.is_admin
-        and await contest.is_contestant(current_user)
+        and await loader.is_contestant(contest, current_user)
     ):
         abort(400)
 
     await contest.participations.filter(contestant=current_user.user).delete()
+    Contest.invalidate_contestants(contest.id)
+    ContestScoreboard.invalidate(contest.id)
     await flash("Successfully left.", "success")
     return redirect(url_for("main.contest.contest_page", contest_id=contest.id))
 
 
 @contest_blueprint.route("/submissions")
 async def submissions_page(contest_id: int) -> str:
-    contest = await Contest.filter(id=contest_id).prefetch_related("tasks").first()
+    contest = await get_loader().get_contest(contest_id, "tasks")
 
     if current_user.is_admin:
         submissions = contest.submissions.all()
-    elif contest.status == ContestStatus.ONGOING and await contest.is_contestant(current_user):
+        count_key = f"contest:{contest.id}:admin"
+    elif (
+        contest.status == ContestStatus.ONGOING
+        and await get_loader().is_contestant(contest, current_user)
+    ):
         submissions = contest.submissions.filter(author=current_user.user)
+        count_key = f"contest:{contest.id}:user:{current_user.id}"
     else:
         submissions = contest.submissions.filter(task__is_public=True)
-    cnt = await submissions.count()
-    page = get_page()
-    submissions = await submissions.offset(
-        (page - 1) * 50
-    ).limit(50).prefetch_related("task", "author", "contest")
-    pagination = Pagination(submissions, page=page, per_page=50, total=cnt)
+        count_key = f"contest:{contest.id}:public"
+    form = SubmissionFilterForm(formdata=request.args)
+    del form.contest
+    submissions, filters = await filter_submissions(submissions, form)
+    total = await get_approximate_count(f"{count_key}:{filters}", submissions)
+    submissions, pagination = await paginate_by_id(
+        submissions.prefetch_related("task", "author", "contest"), per_page=50, total=total
+    )
 
     return await render_template(
         "contest/contest_submissions.html",
         title=f"Submissions - {contest.title}",
         contest=contest,
         contest_tasks=list(contest.tasks),
+        form=form,
+        filters=filters,
         submissions=submissions,
         pagination=pagination,
-        show_pagination=cnt > 50
+        show_pagination=pagination.has_newer or pagination.has_older
     )
 
 
 @contest_blueprint.route("/results")
 async def results(contest_id: int) -> str:
-    contest = await Contest.filter(id=contest_id).prefetch_related("tasks").first()
+    contest = await get_loader().get_contest(contest_id, "tasks")
     contest_tasks = list(contest.tasks)
-
-    contest_participations = await contest.participations.all().prefetch_related(
-        "task_points", "contestant"
-    )
-
-    # Every submission in the contest in one query, rather than one query per
-    # contestant per task for the first solves and one per contestant for the
-    # last submission time. Only the columns below are read, so the source code
-    # stays in the database.
-    submissions = await contest.submissions.all().only(
-        "id", "time", "task_id", "author_id", "first_solve"
-    ).order_by("id")
-
-    first_solves = {}  # (contestant, task) -> first solve
-    first_to_solve = {}  # task -> contestant who solved it first
-    last_submission_times = {}  # contestant -> time of their last submission
-    for submission in submissions:
-        previous = last_submission_times.get(submission.author_id)
-        if previous is None or submission.time > previous:
-            last_submission_times[submission.author_id] = submission.time
-        if submission.first_solve:
-            first_solves[(submission.author_id, submission.task_id)] = submission
-            # Submissions are ordered by id, so the first one seen for a task
-            # is the earliest solve of it
-            first_to_solve.setdefault(submission.task_id, submission.author_id)
-
-    total_points = {
-        cp.id: sum(ctp.total_points for ctp in cp.task_points) for cp in contest_participations
-    }
-    # Contestants who never submitted sort behind everyone who did
-    no_submission_time = contest.end_time + timedelta(seconds=1)
-
-    # Sort contest participations by points, last submission time, then username
-    contest_participations.sort(
-        key=lambda cp: (
-            -total_points[cp.id],
-            last_submission_times.get(cp.contestant_id, no_submission_time),
-            cp.contestant.username
-        )
-    )
-
-    # Values for the template, which must not read a relation itself (see
-    # contest_page above)
-    rows = []
-    for cp in contest_participations:
-        task_results = []
-        for task in contest_tasks:
-            ctp = next((ctp for ctp in cp.task_points if ctp.task_id == task.id), None)
-            first_solve = first_solves.get((cp.contestant_id, task.id))
-            task_results.append(
-                {
-                    "points": ctp.total_points if ctp else None,
-                    "time_taken": first_solve.time - contest.start_time if first_solve else None,
-                    "solved_first": first_to_solve.get(task.id) == cp.contestant_id
-                }
-            )
-        rows.append(
-            {
-                "contestant": cp.contestant,
-                "total_points": total_points[cp.id],
-                "task_results": task_results
-            }
-        )
+    scoreboard = await ContestScoreboard.get(contest)
 
     return await render_template(
         "contest/contest_results.html",
         title=f"Results - {contest.title}",
         contest=contest,
         contest_tasks=contest_tasks,
-        rows=rows,
+        rows=scoreboard.get_rows(contest_tasks),
         contest_tasks_count=len(contest_tasks)
     )
 
 
 @contest_blueprint.route("/editorial")
 async def editorial(contest_id: int) -> str:
-    contest = await Contest.filter(id=contest_id).prefetch_related("tasks").first()
+    contest = await get_loader().get_contest(contest_id, "tasks")
     if not contest.publish_editorial:
         abort(404)
 
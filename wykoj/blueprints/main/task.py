@@ -1,41 +1,39 @@
-import os
-import zipfile
 from datetime import datetime, timedelta
-from io import BytesIO
 from typing import Union
 
 from pytz import utc
 from quart import (
-    Blueprint, Response, abort, current_app, flash, g, redirect, render_template, request,
-    send_file, url_for
+    Blueprint, Response, abort, flash, g, redirect, render_template, request, send_file, url_for
 )
-from quart.utils import run_sync
 from quart_auth import current_user, login_required
-
-from wykoj.api import JudgeAPI, TestCaseAPI
-from wykoj.api.test_cases import get_package_path
-from wykoj.blueprints.utils.misc import get_page, get_running_contest, join_authors, join_contests
-from wykoj.blueprints.utils.pagination import Pagination
+from tortoise.transactions import in_transaction
+
+from wykoj.api import JudgeAPI, JudgeQueue, TestCaseAPI
+from wykoj.blueprints.utils.loader import get_loader
+from wykoj.blueprints.utils.misc import filter_submissions, join_authors, join_contests
+from wykoj.blueprints.utils.package import get_package_zip
+from wykoj.blueprints.utils.pagination import get_approximate_count, paginate_by_id
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
 from wykoj.constants import ContestStatus
-from wykoj.forms.main import TaskSubmitForm
-from wykoj.models import Submission, Task
+from wykoj.forms.main import SubmissionFilterForm, TaskSubmitForm
+from wykoj.models import Submission, SubmissionSource
 
 task_blueprint = Blueprint("task", __name__, url_prefix="/task/<string:task_id>")
 
 
 @task_blueprint.before_request
 async def before_request() -> None:
-    task_id = request.view_args["task_id"]
-    task = await Task.filter(task_id__iexact=task_id).first()
+    loader = get_loader()
+    task = await loader.get_task(request.view_args["task_id"])
     if not task:
         abort(404)
 
-    contest = await get_running_contest()
+    contest = await loader.get_running_contest()
     if not (
         current_user.is_admin
-        or task.is_public and not (contest and await contest.is_contestant(current_user))
+        or task.is_public and not (contest and await loader.is_contestant(contest, current_user))
         or contest and contest.status == ContestStatus.ONGOING and task in contest.tasks
-        and await contest.is_contestant(current_user)
+        and await loader.is_contestant(contest, current_user)
     ):
         abort(404)
 
@@ -49,8 +47,7 @@ async def before_request() -> None:
 
 @task_blueprint.route("/")
 async def task_page(task_id: str) -> str:
-    task = await Task.filter(task_id__iexact=task_id).prefetch_related("authors",
-                                                                       "contests").first()
+    task = await get_loader().get_task(task_id, "authors", "contests")
 
     config = await TestCaseAPI.get_config(task.task_id)
     batched = config and config["batched"]
@@ -67,37 +64,27 @@ async def task_page(task_id: str) -> str:
     )
 
 
-@run_sync
-def _zip_folder_to_bytes(folder_path: str) -> BytesIO:
-    buffer = BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zf.write(file_path, arcname=os.path.relpath(file_path, folder_path))
-    buffer.seek(0)
-    return buffer
-
-
 @task_blueprint.route("/package")
 async def download_package(task_id: str) -> Response:
-    task = await Task.filter(task_id__iexact=task_id).first()
+    task = await get_loader().get_task(task_id)
     if not task.allow_download or not await TestCaseAPI.package_exists(task.task_id):
         abort(404)
 
-    path = get_package_path(task.task_id)
-
-    if path.endswith(".zip"):
-        return await send_file(path, as_attachment=True, attachment_filename="package.zip")
-    buffer = await _zip_folder_to_bytes(path)
-    return await send_file(buffer, as_attachment=True, attachment_filename="package.zip")
+    path = await get_package_zip(task.task_id)
+    if not path:
+        abort(404)
+    # ETag from the path, size and modified time, with Range support
+    return await send_file(
+        path, as_attachment=True, attachment_filename="package.zip", conditional=True
+    )
 
 
 @task_blueprint.route("/submit", methods=["GET", "POST"])
 @login_required
 async def submit(task_id: str) -> Union[Response, str]:
-    task = await Task.filter(task_id__iexact=task_id).first()
-    contest = await get_running_contest()
+    loader = get_loader()
+    task = await loader.get_task(task_id)
+    contest = await loader.get_running_contest()
     if not g.test_cases_ready or not g.judge_is_online:
         abort(404)
 
@@ -122,16 +109,21 @@ async def submit(task_id: str) -> Union[Response, str]:
             else:
                 source_code = form.source_code.data
 
-            submission = await Submission.create(
-                time=datetime.now(utc).replace(microsecond=0),
-                task=task,
-                author=current_user.user,
-                language=form.language.data,
-                source_code=source_code,
-                contest=contest if contest and await contest.is_contestant(current_user) else None
+            submission_contest = (
+                contest if contest and await loader.is_contestant(contest, current_user) else None
             )
-
-            current_app.add_background_task(JudgeAPI.judge_submission, submission)
+            async with in_transaction():
+                submission = await Submission.create(
+                    time=datetime.now(utc).replace(microsecond=0),
+                    task=task,
+                    author=current_user.user,
+                    language=form.language.data,
+                    contest=submission_contest
+                )
+                await SubmissionSource.create(submission=submission, source_code=source_code)
+
+            await ContestScoreboard.record_submission(submission)
+            await JudgeQueue.enqueue(submission)
             return redirect(url_for("main.submission_page", submission_id=submission.id))
     elif request.method == "GET":
         form.language.data = current_user.language
@@ -143,27 +135,34 @@ async def submit(task_id: str) -> Union[Response, str]:
 
 @task_blueprint.route("/submissions")
 async def submissions_page(task_id: str) -> str:
-    task = await Task.filter(task_id__iexact=task_id).first()
-    contest = await get_running_contest()
+    loader = get_loader()
+    task = await loader.get_task(task_id)
+    contest = await loader.get_running_contest()
 
     submissions = task.submissions.all()
+    form = SubmissionFilterForm(formdata=request.args)
+    del form.task
     if (
         contest and contest.status == ContestStatus.ONGOING
-        and await contest.is_contestant(current_user) and not current_user.is_admin
+        and await loader.is_contestant(contest, current_user) and not current_user.is_admin
     ):
         submissions = submissions.filter(author=current_user.user, contest=contest)
-    cnt = await submissions.count()
-    page = get_page()
-    submissions = await submissions.offset(
-        (page - 1) * 50
-    ).limit(50).prefetch_related("task", "author", "contest")
-    pagination = Pagination(submissions, page=page, per_page=50, total=cnt)
+        count_key = f"task:{task.id}:contest:{contest.id}:user:{current_user.id}"
+    else:
+        count_key = f"task:{task.id}"
+    submissions, filters = await filter_submissions(submissions, form)
+    total = await get_approximate_count(f"{count_key}:{filters}", submissions)
+    submissions, pagination = await paginate_by_id(
+        submissions.prefetch_related("task", "author", "contest"), per_page=50, total=total
+    )
 
     return await render_template(
         "task/task_submissions.html",
         title=f"Submissions - Task {task.task_id}",
         task=task,
+        form=form,
+        filters=filters,
         submissions=submissions,
         pagination=pagination,
-        show_pagination=cnt > 50
+        show_pagination=pagination.has_newer or pagination.has_older
     )
@@ -6,18 +6,19 @@ from tortoise.expressions import Q
 from tortoise.functions import Count
 
 from wykoj.blueprints.utils.access import contest_redirect
-from wykoj.blueprints.utils.misc import get_page
-from wykoj.blueprints.utils.pagination import Pagination
+from wykoj.blueprints.utils.loader import get_loader
+from wykoj.blueprints.utils.misc import filter_submissions
+from wykoj.blueprints.utils.pagination import get_approximate_count, paginate_by_id
 from wykoj.constants import ContestStatus
-from wykoj.models import Submission, Task, User
+from wykoj.forms.main import SubmissionFilterForm
+from wykoj.models import Submission, Task
 
 user_blueprint = Blueprint("user", __name__, url_prefix="/user/<string:username>")
 
 
 @user_blueprint.before_request
 async def before_request() -> None:
-    username = request.view_args["username"]
-    user = await User.filter(username__iexact=username).first()
+    user = await get_loader().get_user(request.view_args["username"])
     if not user:
         abort(404)
 
@@ -26,9 +27,9 @@ async def before_request() -> None:
 @login_required  # Do not expose user info to public
 @contest_redirect
 async def user_page(username: str) -> str:
-    user = await User.filter(username__iexact=username).prefetch_related(
-        "contest_participations__contest__tasks", "authored_tasks"
-    ).first()
+    user = await get_loader().get_user(
+        username, "contest_participations__contest__tasks", "authored_tasks"
+    )
 
     # Contests
     # Templates render in async mode, so reading a Tortoise relation from one
@@ -74,7 +75,9 @@ async def user_page(username: str) -> str:
     submission_task_ids = [submission.task_id for submission in submissions]
     task_count = await Task.filter(Q(is_public=True) | Q(id__in=submission_task_ids)).count()
 
-    submission_count = await user.submissions.all().count()
+    submission_count = (
+        await user.submissions.all().count() + await user.archived_submissions.all().count()
+    )
 
     return await render_template(
         "user/user.html",
@@ -92,23 +95,28 @@ async def user_page(username: str) -> str:
 @user_blueprint.route("/submissions")
 @contest_redirect
 async def submissions_page(username: str) -> str:
-    user = await User.filter(username__iexact=username).first()
+    user = await get_loader().get_user(username)
 
     if current_user.is_admin:
         submissions = user.submissions.all()
     else:
         submissions = user.submissions.filter(task__is_public=True)
-    cnt = await submissions.count()
-    page = get_page()
-    submissions = await submissions.offset(
-        (page - 1) * 50
-    ).limit(50).prefetch_related("task", "author", "contest")
-    pagination = Pagination(submissions, page=page, per_page=50, total=cnt)
+    form = SubmissionFilterForm(formdata=request.args)
+    del form.user
+    submissions, filters = await filter_submissions(submissions, form)
+    total = await get_approximate_count(
+        f"user:{user.id}:{current_user.is_admin}:{filters}", submissions
+    )
+    submissions, pagination = await paginate_by_id(
+        submissions.prefetch_related("task", "author", "contest"), per_page=50, total=total
+    )
     return await render_template(
         "user/user_submissions.html",
         title=f"Submissions - User {user.username}",
         user=user,
+        form=form,
+        filters=filters,
         submissions=submissions,
         pagination=pagination,
-        show_pagination=cnt > 50
+        show_pagination=pagination.has_newer or pagination.has_older
     )
@@ -9,7 +9,7 @@ from quart import Blueprint, Response, redirect, request, url_for, current_app
 from quart_auth import current_user
 
 import wykoj
-from wykoj.api import JudgeAPI
+from wykoj.api import JudgeAPI, JudgeQueue
 
 logger = logging.getLogger(__name__)
 misc = Blueprint("misc", __name__)
@@ -57,6 +57,13 @@ async def check_judge_status_forever() -> None:
     async def _check_judge_status_forever() -> None:
         while True:
             await JudgeAPI.update_status()
-            await asyncio.sleep(60)
+            # Check more often while a host is down, so it rejoins the pool soon after recovery
+            await asyncio.sleep(60 if all(host.is_online for host in JudgeAPI.get_hosts()) else 10)
 
     current_app.add_background_task(_check_judge_status_forever)
+
+
+@misc.before_app_serving
+async def run_judge_queue() -> None:
+    # Submissions queued before a restart are picked up again here
+    current_app.add_background_task(JudgeQueue.run_forever)
@@ -6,7 +6,7 @@ from quart import abort, current_app, redirect, request, url_for
 from quart_auth import current_user, login_required
 from quart_rate_limiter import rate_exempt
 
-from wykoj.blueprints.utils.misc import get_running_contest
+from wykoj.blueprints.utils.loader import get_loader
 
 logger = logging.getLogger(__name__)
 
@@ -15,10 +15,11 @@ def contest_redirect(f: Callable[..., Any]) -> Callable[..., Any]:
     """Decorator to redirect contestants to contest page if they try to access an unrelated page."""
     @wraps(f)
     async def inner(*args: Any, **kwargs: Any) -> Any:
-        contest = await get_running_contest()
+        loader = get_loader()
+        contest = await loader.get_running_contest()
         if (
             contest and await current_user.is_authenticated and not current_user.is_admin
-            and await contest.is_contestant(current_user)
+            and await loader.is_contestant(contest, current_user)
         ):
             return redirect(url_for("main.contest.contest_page", contest_id=contest.id))
         return await f(*args, **kwargs)
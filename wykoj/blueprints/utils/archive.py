@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pytz import utc
+from tortoise.functions import Max
+from tortoise.transactions import in_transaction
+
+from wykoj.constants import ContestStatus, Verdict
+from wykoj.models import (
+    ArchivedSubmission, Contest, JudgeJob, PackedTestCaseResults, Submission, SubmissionSource,
+    TestCaseResult
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionArchiving:
+    """
+    Moves judged submissions older than a given age into the archived submission table in
+    batches. Runs in the background one at a time.
+
+    Kept in the submission table whatever their age are accepted submissions, the latest
+    submission of each user to each task, and submissions to contests that have not ended.
+    First solves, and the solves moved to when one is deleted or rejudged, are thus always in
+    the submission table, and solve counts, solved tasks and attempt counts are unchanged by
+    archiving. Contest task points are recalculated from archived submissions as well.
+    """
+    BATCH_SIZE = 200
+
+    _task: Optional[asyncio.Task] = None
+    # Shown on the admin home page
+    status: Dict[str, Any] = {
+        "running": False,
+        "done": 0,
+        "total": 0,
+        "start_time": None,
+        "finish_time": None
+    }
+
+    @staticmethod
+    def schedule(max_age: timedelta) -> bool:
+        """Start archiving, unless already running. Returns whether it was started."""
+        if SubmissionArchiving._task and not SubmissionArchiving._task.done():
+            return False
+        SubmissionArchiving._task = asyncio.create_task(SubmissionArchiving._run(max_age))
+        return True
+
+    @staticmethod
+    async def _run(max_age: timedelta) -> None:
+        try:
+            await SubmissionArchiving.run(max_age)
+        except Exception as e:
+            logger.error(f"Error in archiving submissions:\n{e.__class__.__name__}: {str(e)}")
+            SubmissionArchiving.status["running"] = False
+
+    @staticmethod
+    async def _get_archivable_ids(max_age: timedelta) -> List[int]:
+        latest_ids = set(
+            await Submission.all().annotate(last_id=Max("id")).group_by(
+                "author_id", "task_id"
+            ).values_list("last_id", flat=True)
+        )
+        unended_contest_ids = {
+            contest.id for contest in await Contest.all() if contest.status != ContestStatus.ENDED
+        }
+        queued_ids = set(await JudgeJob.all().values_list("submission_id", flat=True))
+        candidates = await Submission.filter(
+            time__lt=datetime.now(utc) - max_age, first_solve=False
+        ).exclude(verdict__in=(Verdict.PENDING, Verdict.ACCEPTED)
+                  ).order_by("id").values_list("id", "contest_id")
+        return [
+            id_ for id_, contest_id in candidates if id_ not in latest_ids
+            and id_ not in queued_ids and contest_id not in unended_contest_ids
+        ]
+
+    @staticmethod
+    async def run(max_age: timedelta) -> None:
+        status = SubmissionArchiving.status
+        status.update(
+            running=True, done=0, total=0, start_time=datetime.now(utc), finish_time=None
+        )
+        ids = await SubmissionArchiving._get_archivable_ids(max_age)
+        status["total"] = len(ids)
+        for i in range(0, len(ids), SubmissionArchiving.BATCH_SIZE):
+            batch = ids[i:i + SubmissionArchiving.BATCH_SIZE]
+            await SubmissionArchiving._archive(batch)
+            status["done"] += len(batch)
+        status.update(running=False, finish_time=datetime.now(utc))
+        logger.info(f"Archived {status['done']} submissions")
+
+    @staticmethod
+    async def _archive(submission_ids: List[int]) -> None:
+        # Rejudged since the IDs were listed
+        submissions = await Submission.filter(id__in=submission_ids).exclude(
+            verdict__in=(Verdict.PENDING, Verdict.ACCEPTED)
+        )
+        submission_ids = [submission.id for submission in submissions]
+        source_codes = dict(
+            await SubmissionSource.filter(submission_id__in=submission_ids
+                                          ).values_list("submission_id", "source_code")
+        )
+        packed = dict(
+            await PackedTestCaseResults.filter(submission_id__in=submission_ids
+                                               ).values_list("submission_id", "data")
+        )
+        # Results not packed yet, from before results were packed
+        unpacked: Dict[int, List[TestCaseResult]] = {}
+        for tcr in await TestCaseResult.filter(submission_id__in=submission_ids):
+            unpacked.setdefault(tcr.submission_id, []).append(tcr)
+        for submission_id, test_case_results in unpacked.items():
+            packed.setdefault(submission_id, PackedTestCaseResults.pack(test_case_results))
+
+        archived_submissions = [
+            ArchivedSubmission(
+                id=submission.id,
+                time=submission.time,
+                task_id=submission.task_id,
+                author_id=submission.author_id,
+                language=submission.language,
+                verdict=submission.verdict,
+                score=submission.score,
+                _subtask_scores=submission._subtask_scores,
+                time_used=submission.time_used,
+                memory_used=submission.memory_used,
+                first_solve=submission.first_solve,
+                contest_id=submission.contest_id,
+                source_code=source_codes.get(submission.id, ""),
+                packed_test_case_results=packed.get(submission.id)
+            ) for submission in submissions
+        ]
+        async with in_transaction():
+            await ArchivedSubmission.bulk_create(archived_submissions)
+            # Source code and test case results are deleted along with the submissions
+            await Submission.filter(id__in=submission_ids).delete()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pytz import utc
+from tortoise.models import Model
+from tortoise.transactions import in_transaction
+
+from wykoj.constants import Verdict
+from wykoj.models import (
+    Contest, PackedTestCaseResults, Submission, SubmissionSource, Task, TestCaseResult
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TextCompression:
+    """
+    Rewrites compressed text fields in batches, so that rows written before the fields were
+    compressed are stored compressed. Runs in the background one at a time.
+    """
+    BATCH_SIZE = 200
+    # (Model, field) of every compressed text field
+    FIELDS: List[Tuple[Type[Model], str]] = [
+        (SubmissionSource, "source_code"), (Task, "content"), (Contest, "editorial_content")
+    ]
+
+    _task: Optional[asyncio.Task] = None
+    # Shown on the admin home page
+    status: Dict[str, Any] = {
+        "running": False,
+        "stage": None,
+        "done": 0,
+        "total": 0,
+        "start_time": None,
+        "finish_time": None
+    }
+
+    @staticmethod
+    def schedule() -> bool:
+        """Start compressing, unless already running. Returns whether it was started."""
+        if TextCompression._task and not TextCompression._task.done():
+            return False
+        TextCompression._task = asyncio.create_task(TextCompression._run())
+        return True
+
+    @staticmethod
+    async def _run() -> None:
+        try:
+            await TextCompression.run()
+        except Exception as e:
+            logger.error(f"Error in compressing text:\n{e.__class__.__name__}: {str(e)}")
+            TextCompression.status["running"] = False
+
+    @staticmethod
+    async def run() -> None:
+        status = TextCompression.status
+        status.update(running=True, start_time=datetime.now(utc), finish_time=None)
+        for model, field in TextCompression.FIELDS:
+            status.update(
+                stage=f"{model.__name__}.{field}", done=0, total=await model.all().count()
+            )
+            last_id = 0
+            while True:
+                rows = await model.filter(id__gt=last_id).order_by("id").limit(
+                    TextCompression.BATCH_SIZE
+                ).values_list("id", field)
+                if not rows:
+                    break
+                # Values are read decompressed, or as plain text from uncompressed rows,
+                # and compressed again on write
+                async with in_transaction():
+                    for id_, text in rows:
+                        await model.filter(id=id_).update(**{field: text})
+                last_id = rows[-1][0]
+                status["done"] += len(rows)
+        status.update(running=False, stage=None, finish_time=datetime.now(utc))
+        logger.info("Compressed text fields")
+
+
+class TestCaseResultPacking:
+    """
+    Packs test case results of judged submissions still saved as rows, from before results
+    were packed, in batches of submissions. Runs in the background one at a time.
+    """
+    BATCH_SIZE = 100
+
+    _task: Optional[asyncio.Task] = None
+    # Shown on the admin home page
+    status: Dict[str, Any] = {
+        "running": False,
+        "done": 0,
+        "start_time": None,
+        "finish_time": None
+    }
+
+    @staticmethod
+    def schedule() -> bool:
+        """Start packing, unless already running. Returns whether it was started."""
+        if TestCaseResultPacking._task and not TestCaseResultPacking._task.done():
+            return False
+        TestCaseResultPacking._task = asyncio.create_task(TestCaseResultPacking._run())
+        return True
+
+    @staticmethod
+    async def _run() -> None:
+        try:
+            await TestCaseResultPacking.run()
+        except Exception as e:
+            logger.error(
+                f"Error in packing test case results:\n{e.__class__.__name__}: {str(e)}"
+            )
+            TestCaseResultPacking.status["running"] = False
+
+    @staticmethod
+    async def run() -> None:
+        status = TestCaseResultPacking.status
+        status.update(running=True, done=0, start_time=datetime.now(utc), finish_time=None)
+        last_id = 0
+        while True:
+            submission_ids = await TestCaseResult.filter(
+                submission_id__gt=last_id
+            ).order_by("submission_id").distinct().limit(
+                TestCaseResultPacking.BATCH_SIZE
+            ).values_list("submission_id", flat=True)
+            if not submission_ids:
+                break
+            # Results of submissions being judged are packed by their final reports
+            judged_ids = await Submission.filter(
+                id__in=submission_ids, verdict__not=Verdict.PENDING
+            ).values_list("id", flat=True)
+            test_case_results: Dict[int, List[TestCaseResult]] = {}
+            for tcr in await TestCaseResult.filter(submission_id__in=judged_ids):
+                test_case_results.setdefault(tcr.submission_id, []).append(tcr)
+            async with in_transaction():
+                for submission_id, results in test_case_results.items():
+                    await PackedTestCaseResults.replace_rows(submission_id, results)
+            last_id = submission_ids[-1]
+            status["done"] += len(test_case_results)
+        status.update(running=False, finish_time=datetime.now(utc))
+        logger.info(f"Packed test case results of {status['done']} submissions")
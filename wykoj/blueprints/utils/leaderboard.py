@@ -0,0 +1,66 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from tortoise.expressions import Q
+from tortoise.functions import Sum
+
+from wykoj.constants import hkt
+from wykoj.models import DailySolves, User
+
+# Date the leaderboards were built on, and the ranked leaderboards by name
+_leaderboards: Optional[Tuple[date, Dict[str, List[Tuple[int, User]]]]] = None
+# Bumped on invalidation, so that leaderboards built meanwhile are not cached stale
+_version = 0
+
+
+def add_leaderboard_ranks(users: List[User], solves_attr: str) -> List[Tuple[int, User]]:
+    lb = []
+    rank = 1
+    for i in range(len(users)):
+        if i != 0 and getattr(users[i], solves_attr) < getattr(users[i - 1], solves_attr):
+            rank = i + 1
+        lb.append((rank, users[i]))
+    return lb
+
+
+async def _get_rolling_leaderboard(today: date, days: int,
+                                   solves_attr: str) -> List[Tuple[int, User]]:
+    """Leaderboard of first solves over the last `days` days, today included."""
+    rows = await DailySolves.filter(date__gt=today - timedelta(days=days)).annotate(
+        total=Sum("solves")
+    ).group_by("user_id").values("user_id", "total")
+    solves = {row["user_id"]: row["total"] for row in rows if row["total"]}
+    users = await User.filter(Q(is_student=True) | Q(is_admin=True), id__in=solves)
+    for user in users:
+        setattr(user, solves_attr, solves[user.id])
+    users.sort(key=lambda u: (-getattr(u, solves_attr), u.id))
+    return add_leaderboard_ranks(users, solves_attr)
+
+
+async def get_leaderboards() -> Dict[str, List[Tuple[int, User]]]:
+    """
+    All-time, monthly (30 days) and weekly (7 days) leaderboards with ranks. Built from the
+    daily solve counts, then kept until solves change or the day (in Hong Kong time) ends.
+    """
+    global _leaderboards
+    today = datetime.now(hkt).date()
+    if _leaderboards and _leaderboards[0] == today:
+        return _leaderboards[1]
+
+    version = _version
+    users = await User.filter(Q(is_student=True) | Q(is_admin=True)).order_by("-solves", "id")
+    leaderboards = {
+        "all_time": add_leaderboard_ranks(users, "solves"),
+        "monthly": await _get_rolling_leaderboard(today, 30, "monthly_solves"),
+        "weekly": await _get_rolling_leaderboard(today, 7, "weekly_solves")
+    }
+    if _version == version:
+        _leaderboards = (today, leaderboards)
+    return leaderboards
+
+
+def invalidate_leaderboards() -> None:
+    """Call after solves change, or users shown on the leaderboards are edited."""
+    global _leaderboards, _version
+    _leaderboards = None
+    _version += 1
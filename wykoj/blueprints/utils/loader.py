@@ -0,0 +1,79 @@
+from typing import Dict, Optional, Set, Tuple, Union
+
+from quart import g
+
+from wykoj.blueprints.utils.misc import get_running_contest
+from wykoj.models import Contest, Task, User, UserWrapper
+
+_UNSET = object()
+
+
+class RequestLoader:
+    """
+    Lookups memoized for the duration of one request, so that before_request hooks, decorators
+    and views share the rows they load instead of each querying them again.
+    Get the loader of the current request with get_loader().
+    """
+    def __init__(self) -> None:
+        self._tasks: Dict[str, Optional[Task]] = {}  # Lowercase task ID -> task
+        self._users: Dict[str, Optional[User]] = {}  # Lowercase username -> user
+        self._contests: Dict[int, Optional[Contest]] = {}
+        self._running_contest = _UNSET
+        self._is_contestant: Dict[Tuple[int, int], bool] = {}  # (Contest ID, user ID) -> bool
+        self._fetched: Dict[Tuple[str, int], Set[str]] = {}  # (Model, ID) -> relations fetched
+
+    async def _fetch_related(
+        self, obj: Union[Task, User, Contest], relations: Tuple[str, ...]
+    ) -> None:
+        fetched = self._fetched.setdefault((obj.__class__.__name__, obj.id), set())
+        missing = [relation for relation in relations if relation not in fetched]
+        if missing:
+            await obj.fetch_related(*missing)
+            fetched.update(missing)
+
+    async def get_task(self, task_id: str, *prefetch: str) -> Optional[Task]:
+        """Task by case-insensitive task ID, with the given relations fetched."""
+        key = task_id.lower()
+        if key not in self._tasks:
+            self._tasks[key] = await Task.filter(task_id__iexact=task_id).first()
+        task = self._tasks[key]
+        if task:
+            await self._fetch_related(task, prefetch)
+        return task
+
+    async def get_user(self, username: str, *prefetch: str) -> Optional[User]:
+        """User by case-insensitive username, with the given relations fetched."""
+        key = username.lower()
+        if key not in self._users:
+            self._users[key] = await User.filter(username__iexact=username).first()
+        user = self._users[key]
+        if user:
+            await self._fetch_related(user, prefetch)
+        return user
+
+    async def get_contest(self, contest_id: int, *prefetch: str) -> Optional[Contest]:
+        """Contest by ID, with the given relations fetched."""
+        if contest_id not in self._contests:
+            self._contests[contest_id] = await Contest.filter(id=contest_id).first()
+        contest = self._contests[contest_id]
+        if contest:
+            await self._fetch_related(contest, prefetch)
+        return contest
+
+    async def get_running_contest(self) -> Optional[Contest]:
+        if self._running_contest is _UNSET:
+            self._running_contest = await get_running_contest()
+        return self._running_contest
+
+    async def is_contestant(self, contest: Contest, user: Union[User, UserWrapper]) -> bool:
+        key = (contest.id, user.id)
+        if key not in self._is_contestant:
+            self._is_contestant[key] = await contest.is_contestant(user)
+        return self._is_contestant[key]
+
+
+def get_loader() -> RequestLoader:
+    """The loader of the current request, created on first use."""
+    if "loader" not in g:
+        g.loader = RequestLoader()
+    return g.loader
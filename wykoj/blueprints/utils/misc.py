@@ -1,32 +1,75 @@
 import asyncio
 import logging
 import os.path
+from datetime import datetime, time, timedelta
 from secrets import token_hex
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import urljoin, urlparse
 
 import aiofiles.os
 from aiocache import cached
 from PIL import Image
+from pytz import utc
 from quart import abort, current_app, request, url_for
 from quart.datastructures import FileStorage
 from quart.utils import run_sync
 from tortoise.fields import ManyToManyRelation
+from tortoise.queryset import QuerySet
 
-from wykoj.constants import ContestStatus, Verdict
-from wykoj.models import Contest, Submission, User
+from wykoj.constants import ContestStatus, Verdict, hkt
+from wykoj.forms.main import SubmissionFilterForm
+from wykoj.models import Contest, Submission, Task, User
 
 logger = logging.getLogger(__name__)
 
 
+# Running contest and the time until which it stays the running contest
+_running_contest: Optional[Tuple[Optional[Contest], datetime]] = None
+
+
 async def get_running_contest() -> Optional[Contest]:
-    async for contest in Contest.all():
-        if contest.status in (ContestStatus.PREP, ContestStatus.ONGOING):
-            # contest.tasks is read synchronously by callers, so it must be loaded
-            # before returning.
-            await contest.fetch_related("tasks")
-            return contest
-    return None
+    """
+    The newest contest in preparation or ongoing. Cached until the next time a contest starts
+    its preparation or ends, so the database is only queried at those times and after edits.
+    """
+    global _running_contest
+    now = datetime.now(utc)
+    if _running_contest and now < _running_contest[1]:
+        return _running_contest[0]
+
+    # Contests in preparation or ongoing started at most the longest duration ago
+    max_duration = await Contest.all().order_by("-duration").first().values_list(
+        "duration", flat=True
+    ) or 0
+    contests = await Contest.filter(
+        start_time__lte=now + timedelta(minutes=1),
+        start_time__gt=now - timedelta(minutes=max_duration)
+    ).prefetch_related("tasks")  # contest.tasks is read synchronously by callers
+    contest = next(
+        (
+            contest for contest in contests  # Ordered by -id
+            if contest.status in (ContestStatus.PREP, ContestStatus.ONGOING)
+        ),
+        None
+    )
+
+    # A newer contest entering preparation would take over from the running one
+    next_contest = await Contest.filter(
+        start_time__gt=now + timedelta(minutes=1)
+    ).order_by("start_time").first()
+    valid_until = now + timedelta(days=1)
+    if next_contest:
+        valid_until = min(valid_until, next_contest.start_time - timedelta(minutes=1))
+    if contest:
+        valid_until = min(valid_until, contest.end_time)
+    _running_contest = (contest, valid_until)
+    return contest
+
+
+def invalidate_running_contest() -> None:
+    """Call after creating, editing or deleting contests or tasks."""
+    global _running_contest
+    _running_contest = None
 
 
 @cached(ttl=1)
@@ -76,6 +119,44 @@ def get_page() -> int:
         abort(400)
 
 
+async def filter_submissions(
+    submissions: QuerySet, form: SubmissionFilterForm
+) -> Tuple[QuerySet, Dict[str, str]]:
+    """
+    Filter submissions by a submission filter form built from the url parameters.
+    Tasks and users are looked up first, so that filters are on the indexed ID columns.
+    Returns the filtered submissions and the url parameters of the filters in effect.
+    """
+    if not form.validate():
+        abort(400)
+    filters = {field.name: request.args[field.name] for field in form if field.data}
+
+    if "verdict" in filters:
+        submissions = submissions.filter(verdict=form.verdict.data)
+    if "language" in filters:
+        submissions = submissions.filter(language=form.language.data)
+    if "task" in filters:
+        task_id = await Task.filter(task_id__iexact=form.task.data.strip()
+                                    ).first().values_list("id", flat=True)
+        submissions = submissions.filter(task_id=task_id or 0)  # No task has ID 0
+    if "user" in filters:
+        user_id = await User.filter(username__iexact=form.user.data.strip()
+                                    ).first().values_list("id", flat=True)
+        submissions = submissions.filter(author_id=user_id or 0)
+    if "contest" in filters:
+        submissions = submissions.filter(contest_id=form.contest.data)
+    # Dates are in Hong Kong time, both inclusive
+    if "start_date" in filters:
+        submissions = submissions.filter(
+            time__gte=hkt.localize(datetime.combine(form.start_date.data, time()))
+        )
+    if "end_date" in filters:
+        submissions = submissions.filter(
+            time__lt=hkt.localize(datetime.combine(form.end_date.data + timedelta(days=1), time()))
+        )
+    return submissions, filters
+
+
 async def save_picture(profile_pic: FileStorage) -> Tuple[str, str]:
     """Save user profile picture locally inside static/profile_pics/."""
     filename = token_hex(8)
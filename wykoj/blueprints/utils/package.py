@@ -0,0 +1,58 @@
+import asyncio
+import os
+import zipfile
+from tempfile import gettempdir
+from typing import Dict, Optional
+
+from quart.utils import run_sync
+
+from wykoj.api import TestCaseAPI
+from wykoj.api.test_cases import hash_folder
+
+# Archives zipped from package/ folders, named by task ID and folder hash
+CACHE_DIR = os.path.join(gettempdir(), "wykoj_packages")
+
+# Cache path -> lock held while the archive is built, so that it is built once
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+@run_sync
+def _zip_folder(folder_path: str, zip_path: str, task_id: str) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Written to disk file by file, then moved into place so that readers never see
+    # a partial archive
+    tmp_path = f"{zip_path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for root, _, files in os.walk(folder_path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                zf.write(file_path, arcname=os.path.relpath(file_path, folder_path))
+    os.replace(tmp_path, zip_path)
+
+    # Archives of older versions of the folder
+    for fn in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, fn)
+        if fn.startswith(f"{task_id}-") and fn.endswith(".zip") and path != zip_path:
+            os.remove(path)
+
+
+async def get_package_zip(task_id: str) -> Optional[str]:
+    """
+    Path to package.zip of a task. A package/ folder is zipped on first download after
+    it changes, and the archive is kept on disk.
+    """
+    manifest = TestCaseAPI.get_manifest(task_id)
+    if not manifest or not manifest.package_path:
+        return None
+    if manifest.package_path.endswith(".zip"):
+        return manifest.package_path
+
+    package_hash = manifest.package_hash
+    if package_hash is None:  # Manifest not built yet
+        package_hash = await run_sync(hash_folder)(manifest.package_path)
+    zip_path = os.path.join(CACHE_DIR, f"{task_id}-{package_hash[:16]}.zip")
+    lock = _locks.setdefault(zip_path, asyncio.Lock())
+    async with lock:
+        if not await run_sync(os.path.isfile)(zip_path):
+            await _zip_folder(manifest.package_path, zip_path, task_id)
+    return zip_path
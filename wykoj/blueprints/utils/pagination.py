@@ -35,9 +35,11 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 import math
-from typing import Generator, List, Optional
+import time
+from typing import Dict, Generator, List, Optional, Tuple
 
-from quart import abort
+from quart import abort, request
+from tortoise.queryset import QuerySet
 
 
 class Pagination:
@@ -94,3 +96,83 @@ class Pagination:
                 last = num
         if last != self.pages:
             yield None
+
+
+class CursorPagination:
+    """
+    Keyset pagination over items ordered by descending ID. Pages are addressed by the ID they
+    come before or after, so every page is read off the primary key index whatever its depth.
+    Totals are approximate, see get_approximate_count.
+    """
+    def __init__(
+        self,
+        items: List,
+        has_newer: bool,
+        has_older: bool,
+        total: Optional[int] = None
+    ) -> None:
+        self.newer_cursor = items[0].id if items and has_newer else None
+        self.older_cursor = items[-1].id if items and has_older else None
+        self.total = total
+
+    @property
+    def has_newer(self) -> bool:
+        return self.newer_cursor is not None
+
+    @property
+    def has_older(self) -> bool:
+        return self.older_cursor is not None
+
+
+async def paginate_by_id(
+    queryset: QuerySet,
+    per_page: int,
+    total: Optional[int] = None
+) -> Tuple[List, CursorPagination]:
+    """
+    Get the page of a queryset given by the url parameter "before" or "after" (an item ID),
+    or the first page without either.
+    """
+    try:
+        before = request.args.get("before", type=int)
+        after = request.args.get("after", type=int)
+        if before is not None and after is not None or any(
+            cursor is not None and cursor < 1 for cursor in (before, after)
+        ):
+            raise ValueError
+    except ValueError:
+        abort(400)
+
+    if after is not None:
+        items = await queryset.filter(id__gt=after).order_by("id").limit(per_page + 1)
+        has_newer = len(items) > per_page
+        items = items[:per_page][::-1]
+        has_older = True
+    else:
+        if before is not None:
+            queryset = queryset.filter(id__lt=before)
+        items = await queryset.order_by("-id").limit(per_page + 1)
+        has_newer = before is not None
+        has_older = len(items) > per_page
+        items = items[:per_page]
+
+    if not items and (before is not None or after is not None):
+        abort(404)
+    return items, CursorPagination(items, has_newer, has_older, total)
+
+
+# Key -> (time counted, count)
+_counts: Dict[str, Tuple[float, int]] = {}
+MAX_CACHED_COUNTS = 10000
+
+
+async def get_approximate_count(key: str, queryset: QuerySet, ttl: float = 60) -> int:
+    """Count of a queryset, cached under `key` for `ttl` seconds as counting scans the table."""
+    cached = _counts.get(key)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    count = await queryset.count()
+    if len(_counts) >= MAX_CACHED_COUNTS:
+        _counts.clear()
+    _counts[key] = (time.monotonic(), count)
+    return count
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Union
+
+from pytz import utc
+from quart import current_app
+from tortoise.expressions import Q
+from tortoise.fields import ReverseRelation
+
+from wykoj.api import JudgeQueue, TestCaseAPI
+from wykoj.blueprints.api.judge import recalculate_contest_task_points
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
+from wykoj.blueprints.utils.solves import SolveRecalculation
+from wykoj.constants import JudgePriority, Verdict
+from wykoj.models import ContestParticipation, JudgeJob, PackedTestCaseResults, Submission
+
+logger = logging.getLogger(__name__)
+
+
+async def reset_submission(submission: Submission) -> None:
+    submission.verdict = Verdict.PENDING
+    submission.score = 0
+    submission._subtask_scores = None
+    submission.time_used = None
+    submission.memory_used = None
+    submission.first_solve = False
+    await submission.save()
+    await submission.test_case_results.all().delete()
+    await PackedTestCaseResults.filter(submission_id=submission.id).delete()
+
+
+async def rejudge_submissions(
+    submissions: Union[List[Submission], ReverseRelation[Submission]],
+    recalculate_solves: bool = True
+) -> None:
+    await asyncio.gather(
+        *[submission.fetch_related("task", "author") for submission in submissions]
+    )
+    submissions = sorted(submissions, key=lambda s: s.id)
+
+    await asyncio.gather(*[reset_submission(submission) for submission in submissions])
+    await recalc_contest_task_points(submissions)
+    await JudgeQueue.enqueue(*submissions, priority=JudgePriority.REJUDGE)
+    if recalculate_solves:
+        # Solves are recalculated again once the last rejudged submission is reported
+        SolveRecalculation.schedule()
+
+
+async def recalc_contest_task_points(submissions: List[Submission]) -> None:
+    """
+    Recalculate contest task points of reset submissions from scratch. Judge reports only
+    ever raise points, so the scores these submissions had must be taken out beforehand.
+    """
+    keys = {(s.contest_id, s.author_id, s.task) for s in submissions if s.contest_id}
+    if not keys:
+        return
+    for contest_id in {contest_id for contest_id, _, _ in keys}:
+        ContestScoreboard.invalidate(contest_id)
+    contest_participations = {
+        (cp.contest_id, cp.contestant_id): cp
+        for cp in await ContestParticipation.filter(
+            contest_id__in={contest_id for contest_id, _, _ in keys},
+            contestant_id__in={author_id for _, author_id, _ in keys}
+        ).prefetch_related("task_points")
+    }
+    for contest_id, author_id, task in keys:
+        contest_participation = contest_participations.get((contest_id, author_id))
+        if contest_participation:
+            await recalculate_contest_task_points(contest_participation, task)
+
+
+class StaleRejudge:
+    """
+    Rejudges submissions to tasks whose test cases changed, i.e. judged against another
+    revision of the test cases, after a test case sync if AUTO_REJUDGE is set. Submissions
+    are queued as rejudges in batches, and only while fewer than AUTO_REJUDGE_MAX_QUEUED
+    rejudges are queued, so that judging of new submissions is not held up for long.
+
+    Submissions being judged at the time are looked at again once judged, as they may have
+    been judged against the test cases of before the change.
+    """
+    BATCH_SIZE = 20
+    POLL_INTERVAL = 5  # s, how often the rejudge queue and submissions being judged are checked
+
+    _task: Optional[asyncio.Task] = None
+    _task_ids: Set[str] = set()  # Changed tasks not yet looked at
+    _waiting_ids: Set[int] = set()  # Submissions to changed tasks that were being judged
+    # Shown on the admin home page
+    status: Dict[str, Any] = {
+        "running": False,
+        "done": 0,
+        "total": 0,
+        "start_time": None,
+        "finish_time": None
+    }
+
+    @staticmethod
+    def schedule(task_ids: Set[str]) -> None:
+        """Rejudge stale submissions to tasks in `task_ids`, after those already scheduled."""
+        StaleRejudge._task_ids |= task_ids
+        if StaleRejudge._task and not StaleRejudge._task.done():
+            return
+        StaleRejudge._task = asyncio.create_task(StaleRejudge._run_until_done())
+
+    @staticmethod
+    async def _run_until_done() -> None:
+        status = StaleRejudge.status
+        status.update(
+            running=True, done=0, total=0, start_time=datetime.now(utc), finish_time=None
+        )
+        SolveRecalculation.deferred = True
+        while StaleRejudge._task_ids or StaleRejudge._waiting_ids:
+            try:
+                if StaleRejudge._task_ids:
+                    task_ids = StaleRejudge._task_ids
+                    StaleRejudge._task_ids = set()
+                    await StaleRejudge.run(task_ids)
+                else:
+                    await asyncio.sleep(StaleRejudge.POLL_INTERVAL)
+                    await StaleRejudge._recheck_waiting()
+            except Exception as e:
+                logger.error(
+                    f"Error in rejudging stale submissions:\n{e.__class__.__name__}: {str(e)}"
+                )
+        SolveRecalculation.deferred = False
+        # Once for all batches, rather than per batch or each time the rejudge queue drains
+        SolveRecalculation.schedule()
+        status.update(running=False, finish_time=datetime.now(utc))
+
+    @staticmethod
+    async def _find_stale(**filters: Any) -> List[int]:
+        """
+        IDs of submissions matching `filters` judged against another test case revision.
+        Those being judged are added to the submissions waiting to be looked at again.
+        """
+        revision = TestCaseAPI.get_revision()
+        ids = await Submission.filter(
+            Q(test_case_revision__isnull=True) | ~Q(test_case_revision=revision), **filters
+        ).order_by("id").values_list("id", flat=True)
+        being_judged = set(
+            await JudgeJob.filter(submission_id__in=ids).values_list("submission_id", flat=True)
+        )
+        StaleRejudge._waiting_ids |= being_judged
+        return [id_ for id_ in ids if id_ not in being_judged]
+
+    @staticmethod
+    async def run(task_ids: Set[str]) -> None:
+        if TestCaseAPI.get_revision() is None:
+            return  # Stale submissions cannot be told apart
+        ids = await StaleRejudge._find_stale(task__task_id__in=task_ids)
+        logger.info(
+            f"Rejudging {len(ids)} stale submission(s) of tasks {', '.join(sorted(task_ids))}"
+        )
+        await StaleRejudge._rejudge(ids)
+
+    @staticmethod
+    async def _recheck_waiting() -> None:
+        """Look at waiting submissions again once judged."""
+        waiting_ids = StaleRejudge._waiting_ids
+        still_waiting = set(
+            await JudgeJob.filter(submission_id__in=waiting_ids).values_list(
+                "submission_id", flat=True
+            )
+        )
+        StaleRejudge._waiting_ids = still_waiting
+        judged_ids = waiting_ids - still_waiting
+        if judged_ids and TestCaseAPI.get_revision() is not None:
+            await StaleRejudge._rejudge(await StaleRejudge._find_stale(id__in=judged_ids))
+
+    @staticmethod
+    async def _rejudge(ids: List[int]) -> None:
+        status = StaleRejudge.status
+        status["total"] += len(ids)
+        max_queued = current_app.config.get("AUTO_REJUDGE_MAX_QUEUED", 100)
+        for i in range(0, len(ids), StaleRejudge.BATCH_SIZE):
+            while await JudgeJob.filter(priority=JudgePriority.REJUDGE).count() >= max_queued:
+                await asyncio.sleep(StaleRejudge.POLL_INTERVAL)
+            batch = ids[i:i + StaleRejudge.BATCH_SIZE]
+            # Those rejudged or deleted in the meantime are skipped
+            submissions = await Submission.filter(id__in=batch).exclude(verdict=Verdict.PENDING)
+            await rejudge_submissions(submissions, recalculate_solves=False)
+            status["done"] += len(batch)
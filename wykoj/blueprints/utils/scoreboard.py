@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from statistics import mean, median, pstdev
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from wykoj.constants import Verdict
+from wykoj.models import (
+    ArchivedSubmission, Contest, ContestParticipation, ContestTaskPoints, Submission, Task, User
+)
+
+
+@dataclass
+class ScoreboardEntry:
+    contestant: User
+    participation_id: int
+    task_points: Dict[int, float] = field(default_factory=dict)  # Task ID -> points
+    first_solve_times: Dict[int, datetime] = field(default_factory=dict)  # Task ID -> time
+    last_submission_time: Optional[datetime] = None
+
+    @property
+    def total_points(self) -> float:
+        return sum(self.task_points.values())
+
+
+class ContestScoreboard:
+    """
+    Scoreboard of a contest, built from the database once and then kept in memory.
+
+    Judge reports and new submissions update it in place, while rarer changes (joins, leaves,
+    admin edits, rejudges and deletions) invalidate it, so that it is rebuilt on the next read.
+    """
+    MAX_CACHED = 20  # Scoreboards kept, least recently read dropped first
+
+    _scoreboards: "OrderedDict[int, ContestScoreboard]" = OrderedDict()
+    # Bumped on every change, so that a scoreboard built meanwhile is not cached stale
+    _versions: Dict[int, int] = {}
+
+    def __init__(self, contest: Contest) -> None:
+        self.contest_id = contest.id
+        self.start_time = contest.start_time
+        self.end_time = contest.end_time
+        self.entries: Dict[int, ScoreboardEntry] = {}  # Contestant ID -> entry
+        # Task ID -> (submission ID, contestant ID) of the earliest solve
+        self.first_to_solve: Dict[int, Tuple[int, int]] = {}
+        self._ranking: Optional[List[ScoreboardEntry]] = None
+
+    @staticmethod
+    async def get(contest: Contest) -> "ContestScoreboard":
+        scoreboard = ContestScoreboard._scoreboards.get(contest.id)
+        if scoreboard:
+            ContestScoreboard._scoreboards.move_to_end(contest.id)
+            return scoreboard
+
+        version = ContestScoreboard._versions.get(contest.id, 0)
+        scoreboard = await ContestScoreboard._build(contest)
+        if ContestScoreboard._versions.get(contest.id, 0) == version:
+            ContestScoreboard._scoreboards[contest.id] = scoreboard
+            if len(ContestScoreboard._scoreboards) > ContestScoreboard.MAX_CACHED:
+                ContestScoreboard._scoreboards.popitem(last=False)
+        return scoreboard
+
+    @staticmethod
+    async def _build(contest: Contest) -> "ContestScoreboard":
+        scoreboard = ContestScoreboard(contest)
+        contest_participations = await ContestParticipation.filter(
+            contest_id=contest.id
+        ).prefetch_related("task_points", "contestant")
+        for cp in contest_participations:
+            scoreboard.entries[cp.contestant_id] = ScoreboardEntry(
+                contestant=cp.contestant,
+                participation_id=cp.id,
+                task_points={ctp.task_id: ctp.total_points for ctp in cp.task_points}
+            )
+
+        # Only the columns below are read
+        submissions = [
+            *await Submission.filter(contest_id=contest.id).only(
+                "id", "time", "task_id", "author_id", "first_solve"
+            ),
+            # Last submission times, which break ties, may be of archived submissions
+            *await ArchivedSubmission.filter(contest_id=contest.id).only(
+                "id", "time", "task_id", "author_id", "first_solve"
+            )
+        ]
+        for submission in sorted(submissions, key=lambda s: s.id):
+            scoreboard._add_submission(submission)
+        return scoreboard
+
+    @staticmethod
+    def _bump_version(contest_id: int) -> None:
+        ContestScoreboard._versions[contest_id] = ContestScoreboard._versions.get(contest_id, 0) + 1
+
+    @staticmethod
+    def invalidate(contest_id: int) -> None:
+        ContestScoreboard._bump_version(contest_id)
+        ContestScoreboard._scoreboards.pop(contest_id, None)
+
+    @staticmethod
+    def invalidate_all() -> None:
+        for contest_id in list(ContestScoreboard._scoreboards):
+            ContestScoreboard.invalidate(contest_id)
+
+    @staticmethod
+    def update_contestant(user: User) -> None:
+        """Show a contestant's edited profile, e.g. a new username or profile picture."""
+        for scoreboard in ContestScoreboard._scoreboards.values():
+            entry = scoreboard.entries.get(user.id)
+            if entry:
+                entry.contestant = user
+                scoreboard._ranking = None  # Ties are broken by username
+
+    @staticmethod
+    async def record_submission(submission: Submission) -> None:
+        """Update the contest scoreboard, if built, with a new or judged submission."""
+        if not submission.contest_id:
+            return
+        ContestScoreboard._bump_version(submission.contest_id)
+        scoreboard = ContestScoreboard._scoreboards.get(submission.contest_id)
+        entry = scoreboard and scoreboard.entries.get(submission.author_id)
+        if not entry:
+            return
+
+        if submission.verdict != Verdict.PENDING:
+            task_points = await ContestTaskPoints.filter(
+                participation_id=entry.participation_id, task_id=submission.task_id
+            ).first()
+            if task_points:
+                entry.task_points[submission.task_id] = task_points.total_points
+        scoreboard._add_submission(submission)
+
+    def _add_submission(self, submission: Union[Submission, ArchivedSubmission]) -> None:
+        entry = self.entries.get(submission.author_id)
+        if not entry:
+            return  # Not a contestant any more
+
+        if entry.last_submission_time is None or submission.time > entry.last_submission_time:
+            entry.last_submission_time = submission.time
+        if submission.first_solve:
+            entry.first_solve_times[submission.task_id] = submission.time
+            first = self.first_to_solve.get(submission.task_id)
+            if not first or submission.id < first[0]:
+                self.first_to_solve[submission.task_id] = (submission.id, submission.author_id)
+        self._ranking = None
+
+    def get_ranking(self) -> List[ScoreboardEntry]:
+        """Entries sorted by points, last submission time, then username."""
+        if self._ranking is None:
+            # Contestants who never submitted sort behind everyone who did
+            no_submission_time = self.end_time + timedelta(seconds=1)
+            self._ranking = sorted(
+                self.entries.values(),
+                key=lambda entry: (
+                    -entry.total_points, entry.last_submission_time or no_submission_time,
+                    entry.contestant.username
+                )
+            )
+        return self._ranking
+
+    def get_rows(self, contest_tasks: List[Task]) -> List[Dict[str, Any]]:
+        """Rows of the results page in ranking order."""
+        rows = []
+        for entry in self.get_ranking():
+            task_results = []
+            for task in contest_tasks:
+                first_solve_time = entry.first_solve_times.get(task.id)
+                first = self.first_to_solve.get(task.id)
+                task_results.append(
+                    {
+                        "points": entry.task_points.get(task.id),
+                        "time_taken": (
+                            first_solve_time - self.start_time if first_solve_time else None
+                        ),
+                        "solved_first": first is not None and first[1] == entry.contestant.id
+                    }
+                )
+            rows.append(
+                {
+                    "contestant": entry.contestant,
+                    "total_points": entry.total_points,
+                    "task_results": task_results
+                }
+            )
+        return rows
+
+    def get_stats(self, contest_tasks: List[Task]) -> Dict[str, Dict[str, Any]]:
+        """Points statistics of each task and overall, among contestants with any points."""
+        stats = {task.task_id: {"attempts": 0, "data": []} for task in contest_tasks}
+        stats["overall"] = {"attempts": 0, "data": []}
+        task_ids = {task.id: task.task_id for task in contest_tasks}
+        for entry in self.entries.values():
+            if entry.task_points:
+                stats["overall"]["attempts"] += 1
+                stats["overall"]["data"].append(entry.total_points)
+                for task_id, points in entry.task_points.items():
+                    if task_id in task_ids:
+                        stats[task_ids[task_id]]["attempts"] += 1
+                        stats[task_ids[task_id]]["data"].append(points)
+        for key in stats:
+            stats[key]["max"] = max(stats[key]["data"], default="--")
+            stats[key]["max_cnt"] = stats[key]["data"].count(stats[key]["max"]
+                                                             ) if stats[key]["attempts"] else "--"
+            stats[key]["mean"] = mean(stats[key]["data"]) if stats[key]["attempts"] else "--"
+            stats[key]["median"] = median(stats[key]["data"]) if stats[key]["attempts"] else "--"
+            stats[key]["sd"] = pstdev(stats[key]["data"]) if stats[key]["attempts"] else "--"
+        return stats
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from pytz import utc
+from tortoise.functions import Count, Min
+from tortoise.models import Model
+from tortoise.transactions import in_transaction
+
+from wykoj.blueprints.utils.leaderboard import invalidate_leaderboards
+from wykoj.blueprints.utils.scoreboard import ContestScoreboard
+from wykoj.constants import Verdict
+from wykoj.models import DailySolves, Submission, Task, User
+
+logger = logging.getLogger(__name__)
+
+
+class SolveRecalculation:
+    """
+    Recalculates first solve flags, then task and user solve counts and daily solves, with
+    grouped queries and writes in batches. Runs in the background one at a time; requests made
+    while running are coalesced into one more run afterwards.
+
+    The first solve of a task by a user is their accepted submission with the lowest ID.
+    """
+    BATCH_SIZE = 1000
+
+    _task: Optional[asyncio.Task] = None
+    _rerun = False
+    # Set while StaleRejudge runs, which schedules one recalculation once done, so that
+    # judge reports do not schedule one each time the rejudge queue drains meanwhile
+    deferred = False
+    # Shown on the admin home page
+    status: Dict[str, Any] = {
+        "running": False,
+        "stage": None,
+        "done": 0,
+        "total": 0,
+        "start_time": None,
+        "finish_time": None,
+        "changes": None
+    }
+
+    @staticmethod
+    def schedule() -> None:
+        """Start a recalculation, or queue one to follow the recalculation already running."""
+        if SolveRecalculation._task and not SolveRecalculation._task.done():
+            SolveRecalculation._rerun = True
+            return
+        SolveRecalculation._task = asyncio.create_task(SolveRecalculation._run_until_done())
+
+    @staticmethod
+    async def _run_until_done() -> None:
+        while True:
+            SolveRecalculation._rerun = False
+            try:
+                await SolveRecalculation.run()
+            except Exception as e:
+                logger.error(f"Error in recalculating solves:\n{e.__class__.__name__}: {str(e)}")
+                SolveRecalculation.status["running"] = False
+            if not SolveRecalculation._rerun:
+                return
+
+    @staticmethod
+    def _set_stage(stage: str, total: int) -> None:
+        SolveRecalculation.status.update(stage=stage, done=0, total=total)
+
+    @staticmethod
+    async def run() -> None:
+        status = SolveRecalculation.status
+        status.update(
+            running=True, start_time=datetime.now(utc), finish_time=None, changes=None
+        )
+        changes = {}
+
+        # First solve flags. Each batch of users is locked as by judge reports, so that no
+        # report of theirs is applied between reading and writing their flags
+        user_ids = await User.all().order_by("id").values_list("id", flat=True)
+        SolveRecalculation._set_stage("First solves", len(user_ids))
+        changes["first_solves"] = 0
+        for i in range(0, len(user_ids), SolveRecalculation.BATCH_SIZE):
+            batch = user_ids[i:i + SolveRecalculation.BATCH_SIZE]
+            async with in_transaction():
+                await User.filter(id__in=batch).select_for_update()
+                first_solve_ids = set(
+                    await Submission.filter(verdict=Verdict.ACCEPTED, author_id__in=batch).annotate(
+                        first_id=Min("id")
+                    ).group_by("author_id", "task_id").values_list("first_id", flat=True)
+                )
+                flagged_ids = set(
+                    await Submission.filter(first_solve=True, author_id__in=batch).values_list(
+                        "id", flat=True
+                    )
+                )
+                for ids, first_solve in (
+                    (first_solve_ids - flagged_ids, True), (flagged_ids - first_solve_ids, False)
+                ):
+                    if ids:
+                        await Submission.filter(id__in=ids).update(first_solve=first_solve)
+                        changes["first_solves"] += len(ids)
+            status["done"] += len(batch)
+
+        # Solve counts. Rows are locked in batches, as judge reports increment them in turn
+        for model, column in ((Task, "task_id"), (User, "author_id")):
+            ids = await model.all().order_by("id").values_list("id", flat=True)
+            SolveRecalculation._set_stage(f"{model.__name__} solves", len(ids))
+            changes[f"{model.__name__.lower()}_solves"] = 0
+            for i in range(0, len(ids), SolveRecalculation.BATCH_SIZE):
+                batch = ids[i:i + SolveRecalculation.BATCH_SIZE]
+                async with in_transaction():
+                    old_solves = {
+                        row.id: row.solves
+                        for row in await model.filter(id__in=batch).select_for_update()
+                    }
+                    solves = dict(
+                        await Submission.filter(first_solve=True, **{f"{column}__in": batch})
+                        .annotate(count=Count("id")).group_by(column).values_list(column, "count")
+                    )
+                    changed = [
+                        (id_, solves.get(id_, 0))
+                        for id_, old in old_solves.items() if solves.get(id_, 0) != old
+                    ]
+                    await SolveRecalculation._save_solves(model, changed)
+                changes[f"{model.__name__.lower()}_solves"] += len(changed)
+                status["done"] += len(batch)
+
+        SolveRecalculation._set_stage("Daily solves", 1)
+        await DailySolves.rebuild()
+        status["done"] = 1
+
+        invalidate_leaderboards()
+        ContestScoreboard.invalidate_all()  # First solve times shown may have changed
+        status.update(running=False, stage=None, finish_time=datetime.now(utc), changes=changes)
+        logger.info(f"Recalculated solves: {changes}")
+
+    @staticmethod
+    async def _save_solves(model: Type[Model], changed: List[Tuple[int, int]]) -> None:
+        """Write (ID, solves) pairs."""
+        # Rows of equal solves are updated together, usually far fewer statements than rows
+        ids_by_solves: Dict[int, Set[int]] = {}
+        for id_, solves in changed:
+            ids_by_solves.setdefault(solves, set()).add(id_)
+        for solves, ids in ids_by_solves.items():
+            await model.filter(id__in=ids).update(solves=solves)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from quart import current_app
+from quart.utils import run_sync
+
+from wykoj.api import JudgeAPI, TestCaseAPI
+from wykoj.blueprints.utils.rejudge import StaleRejudge
+
+logger = logging.getLogger(__name__)
+
+
+class TestCaseSync:
+    """
+    Pulls the test case repository with git run as subprocesses, then refreshes the test case
+    manifest and notifies judge hosts of tasks whose test cases changed. Runs in the background
+    one at a time; syncs requested while running, e.g. by a burst of pushes, are coalesced into
+    one more sync afterwards.
+    """
+    _task: Optional[asyncio.Task] = None
+    _rerun = False
+    _revision: Optional[str] = None  # Revision of the last sync
+
+    @staticmethod
+    async def load() -> None:
+        """
+        Build the test case manifest from the test cases already on disk, so that test cases
+        can be served before the first sync, which waits on the network.
+        """
+        revision = await TestCaseSync._get_revision(TestCaseSync._get_env())
+        TestCaseSync._revision = revision
+        await run_sync(TestCaseAPI.refresh)(revision)
+
+    @staticmethod
+    def schedule() -> None:
+        """Start a sync, or queue one to follow the sync already running."""
+        if TestCaseSync._task and not TestCaseSync._task.done():
+            TestCaseSync._rerun = True
+            return
+        TestCaseSync._task = asyncio.create_task(TestCaseSync._run_until_done())
+
+    @staticmethod
+    async def _run_until_done() -> None:
+        while True:
+            TestCaseSync._rerun = False
+            try:
+                await TestCaseSync.run()
+            except Exception as e:
+                logger.error(f"Error in syncing test cases:\n{e.__class__.__name__}: {str(e)}")
+            if not TestCaseSync._rerun:
+                return
+
+    @staticmethod
+    def _get_env() -> Dict[str, str]:
+        env = os.environ.copy()
+        # .git (and the submodule's gitdir under .git/modules/) is bind-mounted
+        # from the host in Docker, so it's owned by the host user rather than
+        # whichever user runs this container process. Git refuses to operate on
+        # repos it doesn't own by default (CVE-2022-24765); this opts back in,
+        # scoped to this subprocess call only.
+        config_entries = [("safe.directory", "*")]
+
+        github_token = current_app.config.get('GITHUB_TOKEN')
+        if github_token:
+            # Authenticates git's https://github.com/... requests with this
+            # token, scoped only to this subprocess call (never written to
+            # disk, e.g. no ~/.git-credentials or .git/config change).
+            config_entries.append((f'url.https://{github_token}@github.com/.insteadOf', 'https://github.com/'))
+
+        env['GIT_CONFIG_COUNT'] = str(len(config_entries))
+        for i, (key, value) in enumerate(config_entries):
+            env[f'GIT_CONFIG_KEY_{i}'] = key
+            env[f'GIT_CONFIG_VALUE_{i}'] = value
+        return env
+
+    @staticmethod
+    async def _git(args: List[str], env: Dict[str, str]) -> Tuple[int, str, str]:
+        """Run git without blocking. Returns the exit code, stdout and stderr."""
+        proc = await asyncio.create_subprocess_exec(
+            'git', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env
+        )
+        stdout, stderr = await proc.communicate()
+        return proc.returncode, stdout.decode(), stderr.decode()
+
+    @staticmethod
+    async def _get_revision(env: Dict[str, str]) -> Optional[str]:
+        returncode, stdout, stderr = await TestCaseSync._git(
+            ['-C', 'test_cases', 'rev-parse', 'HEAD'], env
+        )
+        if returncode != 0:
+            logger.error(f"[GitHub] Failed to get test case revision\n{stderr}")
+            return None
+        return stdout.strip()
+
+    @staticmethod
+    async def _get_changed_tasks(old_revision: str, new_revision: str,
+                                 env: Dict[str, str]) -> Optional[Set[str]]:
+        """IDs of tasks with files changed between two revisions, None if unknown."""
+        # Without rename detection, a moved file is listed under both its old and new path,
+        # so that the task it was moved from is rescanned too
+        returncode, stdout, stderr = await TestCaseSync._git(
+            [
+                '-C', 'test_cases', 'diff', '--name-only', '--no-renames',
+                old_revision, new_revision
+            ],
+            env
+        )
+        if returncode != 0:
+            logger.error(f"[GitHub] Failed to diff test cases\n{stderr}")
+            return None
+        # Paths are relative to the repository root, the first component being the task ID
+        return {path.split("/", 1)[0] for path in stdout.splitlines() if "/" in path}
+
+    @staticmethod
+    async def run() -> None:
+        env = TestCaseSync._get_env()
+        returncode, stdout, stderr = await TestCaseSync._git(
+            ['submodule', 'foreach', 'git', 'pull', 'origin', 'master'], env
+        )
+        if returncode != 0:
+            logger.error(f"[GitHub] Failed to update test cases\n{stdout}{stderr}")
+        else:
+            logger.info(f"[GitHub] Updated test cases\n{stdout}{stderr}")
+
+        old_revision = TestCaseSync._revision
+        revision = await TestCaseSync._get_revision(env)
+        if old_revision and revision:
+            if revision == old_revision:
+                return
+            changed = await TestCaseSync._get_changed_tasks(old_revision, revision, env)
+        else:
+            changed = None  # Unknown, so everything is rescanned
+        TestCaseSync._revision = revision
+
+        await run_sync(TestCaseAPI.refresh)(revision, changed)
+        if changed is None:
+            await JudgeAPI.pull_test_cases()
+        elif changed:
+            logger.info(f"[GitHub] Test cases changed for tasks {', '.join(sorted(changed))}")
+            await JudgeAPI.pull_test_cases(sorted(changed))
+            if current_app.config.get("AUTO_REJUDGE", False):
+                StaleRejudge.schedule(changed)
@@ -68,3 +68,22 @@ class ContestStatus:
     PREP = "prep"
     ONGOING = "ongoing"
     ENDED = "ended"
+
+
+class JudgeJobStatus:
+    QUEUED = "queued"  # Waiting to be sent to the judging backend
+    DISPATCHED = "dispatched"  # Sent to the judging backend, waiting for its report
+
+
+class JudgePriority:
+    # Lower values are dispatched first
+    CONTEST = 0  # Submissions to an ongoing contest
+    PRACTICE = 1
+    REJUDGE = 2  # Rejudges requested by admins
+
+
+JUDGE_PRIORITY_TRANS = {
+    JudgePriority.CONTEST: "Contest",
+    JudgePriority.PRACTICE: "Practice",
+    JudgePriority.REJUDGE: "Rejudge"
+}
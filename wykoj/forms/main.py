@@ -1,10 +1,12 @@
 from flask_wtf.file import FileAllowed, FileField
 from quart_auth import current_user
-from wtforms import BooleanField, PasswordField, SelectField, StringField, SubmitField
-from wtforms.validators import DataRequired, EqualTo, Length, Regexp, ValidationError
+from wtforms import (
+    BooleanField, DateField, IntegerField, PasswordField, SelectField, StringField, SubmitField
+)
+from wtforms.validators import DataRequired, EqualTo, Length, Optional, Regexp, ValidationError
 
 from wykoj.api import ChessComAPI
-from wykoj.constants import ALLOWED_LANGUAGES
+from wykoj.constants import ALLOWED_LANGUAGES, VERDICT_TRANS
 from wykoj.forms.utils import Form, editor_widget, get_filesize
 from wykoj.models import User
 
@@ -103,3 +105,25 @@ class TaskSubmitForm(Form):
 
         if await get_filesize(self.source_code_file.data) > 100 * 1000:
             raise ValidationError("Source code file exceeds 100 kB.")
+
+
+class SubmissionFilterForm(Form):
+    """Filters of submission listings, submitted as url parameters."""
+    class Meta:
+        csrf = False
+
+    verdict = SelectField(
+        "Verdict", choices=[("", "Any Verdict")] + list(VERDICT_TRANS.items()), default=""
+    )
+    language = SelectField(
+        "Language",
+        choices=[("", "Any Language")] + [(lang, lang) for lang in ALLOWED_LANGUAGES],
+        default=""
+    )
+    task = StringField("Task", render_kw={"placeholder": "Task ID"})
+    user = StringField("User", render_kw={"placeholder": "Username"})
+    contest = IntegerField(
+        "Contest", validators=[Optional()], render_kw={"placeholder": "Contest ID"}
+    )
+    start_date = DateField("From", validators=[Optional()])
+    end_date = DateField("To", validators=[Optional()])
@@ -1,17 +1,51 @@
 import re
+import struct
+import zlib
+from collections import Counter
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 from aiocache import cached
 from bs4 import BeautifulSoup
 from pytz import utc
 from quart_auth import AuthUser
 from tortoise import fields
+from tortoise.expressions import F
 from tortoise.functions import Count
 from tortoise.models import Model
+from tortoise.transactions import in_transaction
 
-from wykoj.constants import ContestStatus
+from wykoj.constants import ContestStatus, JudgeJobStatus, JudgePriority, Verdict, hkt
+
+
+class CompressedTextField(fields.TextField):
+    """
+    Text stored zlib-compressed in a blob, behind a format marker. Blobs without the marker are
+    read as plain UTF-8, which is what text columns converted to blobs contain.
+    """
+    SQL_TYPE = "BLOB"
+    MARKER = b"\x00zl1"
+    MIN_COMPRESSED_LENGTH = 256  # Shorter text is stored as is, as compressing it saves little
+
+    class _db_mysql:
+        SQL_TYPE = "LONGBLOB"
+
+    def to_db_value(self, value: Optional[str], instance: Any) -> Optional[bytes]:
+        if value is None:
+            return None
+        data = value.encode()
+        if len(data) < self.MIN_COMPRESSED_LENGTH:
+            return data
+        return self.MARKER + zlib.compress(data)
+
+    def to_python_value(self, value: Union[str, bytes, None]) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if value.startswith(self.MARKER):
+            return zlib.decompress(value[len(self.MARKER):]).decode()
+        return value.decode()
 
 
 class Sidebar(Model):
@@ -45,7 +79,9 @@ class User(Model):
 
     authored_tasks: fields.ManyToManyRelation["Task"]
     submissions: fields.ReverseRelation["Submission"]
+    archived_submissions: fields.ReverseRelation["ArchivedSubmission"]
     contest_participations: fields.ReverseRelation["ContestParticipation"]
+    daily_solves: fields.ReverseRelation["DailySolves"]
 
     class Meta:
         ordering = ("id", )
@@ -99,12 +135,13 @@ class Task(Model):
     authors: fields.ManyToManyRelation[User] = fields.ManyToManyField(
         "models.User", related_name="authored_tasks"
     )
-    content = fields.TextField()
+    content = CompressedTextField()
     time_limit = fields.DecimalField(max_digits=5, decimal_places=3)  # s
     memory_limit = fields.IntField()
     solves = fields.IntField(default=0)
     # Sample test cases and test cases are stored locally inside test_cases/
     submissions: fields.ReverseRelation["Submission"]
+    archived_submissions: fields.ReverseRelation["ArchivedSubmission"]
     contests: fields.ManyToManyRelation["Contest"]
 
     class Meta:
@@ -133,18 +170,25 @@ class Task(Model):
         return text
 
 
+# Contest ID -> contestant IDs, and a counter bumped on changes so that a set loaded
+# meanwhile is not cached stale
+_contestant_ids: Dict[int, Set[int]] = {}
+_contestant_ids_versions: Dict[int, int] = {}
+
+
 class Contest(Model):
     id = fields.IntField(pk=True)
     title = fields.CharField(120)
     is_public = fields.BooleanField()
     # Public = Contest is open to all users and users can join the contest themselves on the contest page
-    start_time = fields.DatetimeField()
+    start_time = fields.DatetimeField(index=True)
     duration = fields.IntField()  # minutes
     publish_editorial = fields.BooleanField(default=False)
-    editorial_content = fields.TextField(default="")
+    editorial_content = CompressedTextField(default="")
     tasks: fields.ManyToManyRelation[Task] = fields.ManyToManyField("models.Task")
     participations: fields.ReverseRelation["ContestParticipation"]
     submissions: fields.ReverseRelation["Submission"]
+    archived_submissions: fields.ReverseRelation["ArchivedSubmission"]
 
     class Meta:
         ordering = ("-id", )
@@ -162,15 +206,28 @@ class Contest(Model):
     async def get_contestants_no(self) -> int:
         return await self.participations.all().count()
 
-    # The key is built from ids on purpose. aiocache's default builder uses repr()
-    # of the arguments, and UserWrapper has no __repr__, so its key component is a
-    # memory address - which CPython hands straight back to the next request's
-    # wrapper, serving one user's membership to every other user for up to a second.
-    @cached(ttl=1, key_builder=lambda f, contest, user: f"is_contestant:{contest.id}:{user.id}")
+    async def get_contestant_ids(self) -> Set[int]:
+        """Contestant IDs, cached until invalidated by a change of the contestants."""
+        contestant_ids = _contestant_ids.get(self.id)
+        if contestant_ids is None:
+            version = _contestant_ids_versions.get(self.id, 0)
+            contestant_ids = set(
+                await ContestParticipation.filter(contest_id=self.id
+                                                  ).values_list("contestant_id", flat=True)
+            )
+            if _contestant_ids_versions.get(self.id, 0) == version:  # Unchanged meanwhile
+                _contestant_ids[self.id] = contestant_ids
+        return contestant_ids
+
+    @staticmethod
+    def invalidate_contestants(contest_id: Optional[int] = None) -> None:
+        """Call after contestants join, leave or are edited. Without an ID, for all contests."""
+        for key in [contest_id] if contest_id is not None else list(_contestant_ids):
+            _contestant_ids_versions[key] = _contestant_ids_versions.get(key, 0) + 1
+            _contestant_ids.pop(key, None)
+
     async def is_contestant(self, user: Union[User, UserWrapper]) -> bool:
-        return user.id is not None and user.id in [
-            contestant.id for contestant in await self.get_contestants()
-        ]
+        return user.id is not None and user.id in await self.get_contestant_ids()
 
     @property
     def status(self) -> str:
@@ -230,6 +287,47 @@ class ContestParticipation(Model):
         return sum(ctp.total_points for ctp in await self.task_points)
 
 
+class DailySolves(Model):
+    """Number of first solves of a user on a day (in Hong Kong time), for rolling leaderboards."""
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="daily_solves"
+    )
+    date = fields.DateField()
+    solves = fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (("user", "date"), )
+        indexes = (("date", "user"), )
+
+    @staticmethod
+    async def add(user_id: int, time: datetime, delta: int = 1) -> None:
+        """Count a first solve made at `time` (or take one away with a negative delta)."""
+        date = time.astimezone(hkt).date()
+        if not await DailySolves.filter(user_id=user_id, date=date
+                                        ).update(solves=F("solves") + delta):
+            await DailySolves.create(user_id=user_id, date=date, solves=delta)
+
+    @staticmethod
+    async def rebuild() -> None:
+        """Recount all daily solves from the first solve flags of submissions."""
+        # In one transaction, so that leaderboards never read the table emptied, and solves
+        # counted meanwhile by judge reports are neither lost nor counted twice
+        async with in_transaction():
+            counts = Counter(
+                (author_id, time.astimezone(hkt).date())
+                for author_id, time in await Submission.filter(first_solve=True
+                                                               ).values_list("author_id", "time")
+            )
+            await DailySolves.all().delete()
+            await DailySolves.bulk_create(
+                [
+                    DailySolves(user_id=user_id, date=date, solves=solves)
+                    for (user_id, date), solves in counts.items()
+                ],
+                batch_size=1000
+            )
+
+
 class TestCaseResult(Model):
     class Meta:
         ordering = ("submission_id", "subtask", "test_case")
@@ -245,6 +343,80 @@ class TestCaseResult(Model):
     )
 
 
+class PackedTestCaseResults(Model):
+    """
+    Test case results of a judged submission, packed into one blob instead of a row each.
+    Results are saved as TestCaseResult rows while judging, then packed by the final report.
+
+    The blob is zlib-compressed columns of little-endian integers, a value per test case in each:
+    subtask, test case, verdict code, then score, time used and memory used in thousandths.
+    """
+    VERSION = 1
+    # The index of a verdict is its code, so new verdicts must be appended
+    VERDICTS = (
+        Verdict.PENDING, Verdict.COMPILATION_ERROR, Verdict.ACCEPTED, Verdict.PARTIAL_SCORE,
+        Verdict.WRONG_ANSWER, Verdict.RUNTIME_ERROR, Verdict.TIME_LIMIT_EXCEEDED,
+        Verdict.MEMORY_LIMIT_EXCEEDED, Verdict.SYSTEM_ERROR, Verdict.SKIPPED,
+        Verdict.SECURITY_VIOLATION
+    )
+    _HEADER = struct.Struct("<BH")  # Version, number of test cases
+    _COLUMN_TYPES = "HHBIII"
+
+    id = fields.IntField(pk=True)
+    submission: fields.OneToOneRelation["Submission"] = fields.OneToOneField(
+        "models.Submission", related_name="packed_test_case_results"
+    )
+    data = fields.BinaryField()
+
+    @staticmethod
+    def pack(test_case_results: List[TestCaseResult]) -> bytes:
+        n = len(test_case_results)
+        columns: Tuple[List[int], ...] = tuple([] for _ in PackedTestCaseResults._COLUMN_TYPES)
+        for tcr in test_case_results:
+            values = (
+                tcr.subtask, tcr.test_case, PackedTestCaseResults.VERDICTS.index(tcr.verdict),
+                round(Decimal(tcr.score) * 1000), round(Decimal(tcr.time_used) * 1000),
+                round(Decimal(tcr.memory_used) * 1000)
+            )
+            for column, value in zip(columns, values):
+                column.append(value)
+        data = PackedTestCaseResults._HEADER.pack(PackedTestCaseResults.VERSION, n)
+        for column_type, column in zip(PackedTestCaseResults._COLUMN_TYPES, columns):
+            data += struct.pack(f"<{n}{column_type}", *column)
+        return zlib.compress(data)
+
+    def unpack(self) -> List[TestCaseResult]:
+        """The test case results as TestCaseResult objects, which are not saved."""
+        data = zlib.decompress(self.data)
+        _, n = PackedTestCaseResults._HEADER.unpack_from(data)
+        offset = PackedTestCaseResults._HEADER.size
+        columns = []
+        for column_type in PackedTestCaseResults._COLUMN_TYPES:
+            column_format = f"<{n}{column_type}"
+            columns.append(struct.unpack_from(column_format, data, offset))
+            offset += struct.calcsize(column_format)
+        return [
+            TestCaseResult(
+                subtask=subtask,
+                test_case=test_case,
+                verdict=PackedTestCaseResults.VERDICTS[verdict],
+                score=Decimal(score).scaleb(-3),
+                time_used=Decimal(time_used).scaleb(-3),
+                memory_used=Decimal(memory_used).scaleb(-3),
+                submission_id=self.submission_id
+            ) for subtask, test_case, verdict, score, time_used, memory_used in zip(*columns)
+        ]
+
+    @staticmethod
+    async def replace_rows(submission_id: int, test_case_results: List[TestCaseResult]) -> None:
+        """Pack the test case result rows of a submission and delete them. Run in a transaction."""
+        await PackedTestCaseResults.filter(submission_id=submission_id).delete()
+        await PackedTestCaseResults.create(
+            submission_id=submission_id, data=PackedTestCaseResults.pack(test_case_results)
+        )
+        await TestCaseResult.filter(submission_id=submission_id).delete()
+
+
 class Submission(Model):
     id = fields.IntField(pk=True)
     time = fields.DatetimeField()
@@ -255,20 +427,28 @@ class Submission(Model):
         "models.User", related_name="submissions"
     )
     language = fields.CharField(30)
-    source_code = fields.TextField()
+    source: fields.BackwardOneToOneRelation["SubmissionSource"]
     verdict = fields.CharField(5, default="pe")
     score = fields.DecimalField(max_digits=6, decimal_places=3, default=0)
     _subtask_scores = fields.TextField(null=True)
     time_used = fields.DecimalField(max_digits=5, decimal_places=3, null=True)  # s
     memory_used = fields.DecimalField(max_digits=7, decimal_places=3, null=True)  # MB
-    test_case_results: fields.ReverseRelation[TestCaseResult]
+    test_case_results: fields.ReverseRelation[TestCaseResult]  # Only while being judged
+    packed_test_case_results: fields.BackwardOneToOneRelation[PackedTestCaseResults]
+    judge_job: fields.BackwardOneToOneRelation["JudgeJob"]
     first_solve = fields.BooleanField(default=False)
     contest: fields.ForeignKeyNullableRelation[Contest] = fields.ForeignKeyField(
         "models.Contest", related_name="submissions", on_delete=fields.SET_NULL, null=True
     )
+    # Revision of the test case repository when last sent to the judge, see StaleRejudge
+    test_case_revision = fields.CharField(40, null=True)
 
     class Meta:
         ordering = ("-id", )
+        # For filtered submission listings, which are ordered by ID
+        indexes = (
+            ("task", "verdict", "id"), ("author", "verdict", "id"), ("contest", "verdict", "id")
+        )
 
     @property
     def subtask_scores(self) -> List[Union[int, float]]:
@@ -284,3 +464,93 @@ class Submission(Model):
     @subtask_scores.setter
     def subtask_scores(self, value: List[Decimal]) -> None:
         self._subtask_scores = ",".join([str(i) for i in value])
+
+    async def get_test_case_results(self) -> List[TestCaseResult]:
+        """
+        Test case results, packed or not. Results of a judged submission still saved as rows,
+        from before results were packed, are packed on the first read.
+        """
+        packed = await PackedTestCaseResults.filter(submission_id=self.id).first()
+        if packed:
+            return packed.unpack()
+        test_case_results = await self.test_case_results.all()
+        if test_case_results and self.verdict != Verdict.PENDING:
+            async with in_transaction():
+                await PackedTestCaseResults.replace_rows(self.id, test_case_results)
+        return test_case_results
+
+
+class ArchivedSubmission(Model):
+    """
+    A judged submission moved out of the submission table once old, see SubmissionArchiving.
+    Keeps the ID, the fields shown on the submission page, the source code and the packed
+    test case results.
+    """
+    id = fields.IntField(pk=True, generated=False)
+    time = fields.DatetimeField()
+    task: fields.ForeignKeyRelation[Task] = fields.ForeignKeyField(
+        "models.Task", related_name="archived_submissions"
+    )
+    author: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="archived_submissions"
+    )
+    language = fields.CharField(30)
+    verdict = fields.CharField(5)
+    score = fields.DecimalField(max_digits=6, decimal_places=3)
+    _subtask_scores = fields.TextField(null=True)
+    time_used = fields.DecimalField(max_digits=5, decimal_places=3, null=True)  # s
+    memory_used = fields.DecimalField(max_digits=7, decimal_places=3, null=True)  # MB
+    first_solve = fields.BooleanField(default=False)  # Accepted submissions are never archived
+    contest: fields.ForeignKeyNullableRelation[Contest] = fields.ForeignKeyField(
+        "models.Contest", related_name="archived_submissions", on_delete=fields.SET_NULL, null=True
+    )
+    source_code = CompressedTextField()
+    packed_test_case_results = fields.BinaryField(null=True)  # See PackedTestCaseResults
+
+    class Meta:
+        ordering = ("-id", )
+
+    subtask_scores = Submission.subtask_scores
+
+    async def get_test_case_results(self) -> List[TestCaseResult]:
+        if not self.packed_test_case_results:
+            return []
+        return PackedTestCaseResults(
+            submission_id=self.id, data=self.packed_test_case_results
+        ).unpack()
+
+
+class SubmissionSource(Model):
+    """
+    Source code of a submission. Kept out of the submission table, so that queries on
+    submissions, which are far more common than reading source code, stay narrow.
+    """
+    id = fields.IntField(pk=True)
+    submission: fields.OneToOneRelation[Submission] = fields.OneToOneField(
+        "models.Submission", related_name="source"
+    )
+    source_code = CompressedTextField()
+
+    @staticmethod
+    async def get_source_code(submission_id: int) -> str:
+        return await SubmissionSource.get(submission_id=submission_id
+                                          ).values_list("source_code", flat=True)
+
+
+class JudgeJob(Model):
+    """A submission waiting to be judged. Deleted once the judging backend reports its result."""
+    id = fields.IntField(pk=True)
+    submission: fields.OneToOneRelation[Submission] = fields.OneToOneField(
+        "models.Submission", related_name="judge_job"
+    )
+    status = fields.CharField(10, default=JudgeJobStatus.QUEUED)
+    priority = fields.IntField(default=JudgePriority.PRACTICE)
+    attempts = fields.IntField(default=0)
+    queue_time = fields.DatetimeField()
+    available_time = fields.DatetimeField()  # Not dispatched before this time, for retry backoff
+    dispatch_time = fields.DatetimeField(null=True)
+    judge_host = fields.CharField(200, null=True)  # URL of the judge host it was dispatched to
+
+    class Meta:
+        ordering = ("id", )
+        indexes = (("status", "priority", "available_time"), )
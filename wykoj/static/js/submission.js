@@ -3,11 +3,21 @@
 import { reloadPage } from "./utils.js";
 
 $(() => {
-    if ($("#result").text() !== "Pending") {
+    const result = $("#result");
+    if (result.text() !== "Pending") {
         return;
     }
 
     const submissionID = location.pathname.match(/\/submission\/(\d+)/)[1];
+    const testCaseCount = result.data("test-case-count");
+
+    function showProgress(testCasesJudged) {
+        result.text(
+            testCaseCount
+                ? `Judging (${testCasesJudged}/${testCaseCount})`
+                : `Judging (${testCasesJudged} judged)`
+        );
+    }
 
     async function updateVerdict() {
         let resp = await fetch(`/api/submission/${submissionID}`);
@@ -16,6 +26,9 @@ $(() => {
             reloadPage();
             return;
         }
+        if (data.test_cases_judged) {
+            showProgress(data.test_cases_judged);
+        }
         // Stop polling once the submission is more than 5 minutes old
         if (Date.now() - data.timestamp * 1000 > 5 * 60 * 1000) {
             return;
@@ -23,5 +36,25 @@ $(() => {
         setTimeout(updateVerdict, 1000);
     }
 
-    setTimeout(updateVerdict, 1000);
+    if (!window.EventSource) {
+        setTimeout(updateVerdict, 1000);
+        return;
+    }
+
+    // Updates are pushed by the server, polling is only the fallback
+    const events = new EventSource(`/api/submission/${submissionID}/events`);
+    events.onmessage = (event) => {
+        let data = JSON.parse(event.data);
+        if (data.verdict && data.verdict !== "pe") {
+            events.close();
+            reloadPage();
+        } else if (data.test_cases_judged) {
+            showProgress(data.test_cases_judged);
+        }
+    };
+    events.onerror = () => {
+        // Also fired when the server ends the stream, don't let the browser reconnect
+        events.close();
+        setTimeout(updateVerdict, 1000);
+    };
 });